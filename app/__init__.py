@@ -23,6 +23,53 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
     mail.init_app(app)  # ✅ initialize mail with app
     
+    # Size the calculation result caches and the @cached result cache
+    from app.utils.cache import calculation_cache, cache_manager, create_cache_backend, structure_result_cache
+    calculation_cache.configure(
+        max_entries=app.config.get('CALCULATION_CACHE_MAX_ENTRIES'),
+        max_bytes=app.config.get('CALCULATION_CACHE_MAX_BYTES')
+    )
+    structure_result_cache.configure(
+        max_entries=app.config.get('STRUCTURE_CACHE_MAX_ENTRIES'),
+        max_bytes=app.config.get('STRUCTURE_CACHE_MAX_BYTES')
+    )
+    cache_manager.configure(
+        backend=create_cache_backend(app.config),
+        default_timeout=app.config.get('CACHE_DEFAULT_TIMEOUT')
+    )
+    
+    # Price source timeouts and the background price refresher
+    from app.utils.http_client import http_client
+    from app.utils.price_fetcher import price_fetcher
+    from app.utils.price_refresher import price_refresher
+    http_client.configure(
+        base_url=app.config.get('PRICE_SOURCE_BASE_URL'),
+        pool_size=app.config.get('PRICE_HTTP_POOL_SIZE'),
+        max_retries=app.config.get('PRICE_HTTP_RETRIES'),
+        backoff=app.config.get('PRICE_HTTP_BACKOFF')
+    )
+    price_fetcher.configure(
+        source_timeout=app.config.get('PRICE_SOURCE_TIMEOUT'),
+        fetch_deadline=app.config.get('PRICE_FETCH_DEADLINE'),
+        live=app.config.get('PRICE_SOURCES_LIVE')
+    )
+    price_refresher.configure(
+        refresh_interval=app.config.get('PRICE_REFRESH_INTERVAL'),
+        retry_interval=app.config.get('PRICE_REFRESH_RETRY')
+    )
+    if app.config.get('PRICE_REFRESHER_ENABLED', True) and not app.config.get('TESTING'):
+        # Started by the first request of each serving process, so CLI
+        # commands never start it and a gunicorn --preload master does not
+        # start a thread that its forked workers would lose
+        @app.before_request
+        def start_price_refresher():
+            price_refresher.start(app)
+    
+    # Precompute results for the built-in house type templates
+    if app.config.get('PRECOMPUTE_TEMPLATE_RESULTS', True):
+        from app.utils.template_results import build_template_results
+        build_template_results()
+    
     # Register custom filters
     @app.template_filter('number_format')
     def number_format(value):
@@ -1,12 +1,14 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, Blueprint
+from flask import render_template, redirect, url_for, flash, request, jsonify, Blueprint, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from sqlalchemy import func, desc
-import json
+import os
 
 from app import db
-from app.models import User, Project, ProjectTemplate, ProjectShare
+from app.models import User, Project, ProjectTemplate, ProjectShare, Team, RecalculationJob, ProjectStructure
 from app.decorators import admin_required
+from app.utils.cache import invalidate_tags, cache_metrics, cache_metrics_prometheus
+from app.utils.price_history import NATIONAL, get_price_audit_log, get_price_series, get_price_series_options
 
 admin = Blueprint('admin', __name__)
 
@@ -162,6 +164,7 @@ def toggle_user_admin(user_id):
     user = User.query.get_or_404(user_id)
     user.is_admin = not user.is_admin
     db.session.commit()
+    invalidate_tags('users')
     
     action = "granted" if user.is_admin else "revoked"
     return jsonify({
@@ -181,6 +184,7 @@ def toggle_user_active(user_id):
     user = User.query.get_or_404(user_id)
     user.is_active = not user.is_active
     db.session.commit()
+    invalidate_tags('users')
     
     action = "activated" if user.is_active else "deactivated"
     return jsonify({
@@ -208,6 +212,7 @@ def bulk_delete_projects():
             deleted_count += 1
         
         db.session.commit()
+        invalidate_tags('projects')
         
         return jsonify({
             'success': True,
@@ -227,6 +232,7 @@ def toggle_user_verified(user_id):
     user = User.query.get_or_404(user_id)
     user.is_verified = not user.is_verified
     db.session.commit()
+    invalidate_tags('users')
     
     action = "verified" if user.is_verified else "unverified"
     return jsonify({
@@ -274,6 +280,7 @@ def update_user(user_id):
     
     user.updated_at = datetime.utcnow()
     db.session.commit()
+    invalidate_tags('users')
     
     return jsonify({
         'success': True,
@@ -296,6 +303,7 @@ def delete_user(user_id):
     # Delete user and all their data (cascade should handle projects)
     db.session.delete(user)
     db.session.commit()
+    invalidate_tags('users', 'projects')
     
     return jsonify({
         'success': True,
@@ -352,6 +360,7 @@ def bulk_user_action():
             return jsonify({'success': False, 'error': 'Invalid action'})
         
         db.session.commit()
+        invalidate_tags('users', 'projects')
         return jsonify({'success': True, 'message': message})
         
     except Exception as e:
@@ -392,6 +401,11 @@ def admin_projects():
     total_projects_count = Project.query.count()
     public_projects_count = Project.query.filter_by(is_public=True).count()
     total_blocks = db.session.query(func.sum(Project.total_blocks)).scalar() or 0
+    
+    # Bulk recalculation panel
+    recalculation_job = RecalculationJob.query.order_by(RecalculationJob.id.desc()).first()
+    house_types = [row[0] for row in db.session.query(Project.house_type).distinct().order_by(Project.house_type).all()]
+    teams = Team.query.order_by(Team.name).all()
 
     
     return render_template('admin/projects.html', 
@@ -401,7 +415,95 @@ def admin_projects():
                          search_query=search_query,
                          total_projects_count=total_projects_count,
                          public_projects_count=public_projects_count,
-                         total_blocks=total_blocks)
+                         total_blocks=total_blocks,
+                         recalculation_job=recalculation_job,
+                         house_types=house_types,
+                         teams=teams)
+
+@admin.route('/admin/recalculate', methods=['POST'])
+@login_required
+@admin_required
+def start_recalculation():
+    """Start a bulk recalculation job for all projects or a filtered subset"""
+    from app.utils.recalculation import (
+        acquire_start_lease, clean_filters, get_active_job, release_start_lease, start_recalculation_job
+    )
+    
+    data = request.get_json() or {}
+    try:
+        filters = clean_filters(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid filter: {e}'})
+    
+    lease_holder = acquire_start_lease()
+    if lease_holder is None:
+        return jsonify({'success': False, 'error': 'A recalculation job is being started'})
+    try:
+        active_job = get_active_job(current_app.config['RECALCULATION_STALE_AFTER'])
+        if active_job:
+            return jsonify({
+                'success': False,
+                'error': 'A recalculation job is already running',
+                'job': active_job.to_dict()
+            })
+        
+        job = start_recalculation_job(current_app._get_current_object(), filters, current_user.id)
+    finally:
+        release_start_lease(lease_holder)
+    
+    return jsonify({
+        'success': True,
+        'message': f'Recalculating {job.total_projects} projects',
+        'job': job.to_dict()
+    })
+
+@admin.route('/admin/recalculate/<int:job_id>/resume', methods=['POST'])
+@login_required
+@admin_required
+def resume_recalculation(job_id):
+    """Resume an interrupted or failed recalculation job from its cursor"""
+    from app.utils.recalculation import (
+        acquire_start_lease, is_running_here, release_start_lease, resume_recalculation_job
+    )
+    
+    job = RecalculationJob.query.get_or_404(job_id)
+    stale_after = current_app.config['RECALCULATION_STALE_AFTER']
+    
+    lease_holder = acquire_start_lease()
+    if lease_holder is None:
+        return jsonify({'success': False, 'error': 'A recalculation job is being started'})
+    try:
+        db.session.refresh(job)  # another worker may have resumed it before we held the lease
+        if job.status == 'completed':
+            return jsonify({'success': False, 'error': 'Job has already completed'})
+        if job.status in ('pending', 'running') and (is_running_here(job.id) or not job.is_interrupted(stale_after)):
+            return jsonify({'success': False, 'error': 'Job is still running'})
+        
+        resume_recalculation_job(current_app._get_current_object(), job)
+    finally:
+        release_start_lease(lease_holder)
+    
+    return jsonify({
+        'success': True,
+        'message': f'Resuming after project #{job.last_project_id}',
+        'job': job.to_dict()
+    })
+
+@admin.route('/api/admin/recalculate/<int:job_id>')
+@login_required
+@admin_required
+def recalculation_status(job_id):
+    """Progress of a recalculation job"""
+    from app.utils.recalculation import is_running_here
+    
+    job = RecalculationJob.query.get_or_404(job_id)
+    job_data = job.to_dict()
+    job_data['interrupted'] = (
+        job.is_interrupted(current_app.config['RECALCULATION_STALE_AFTER'])
+        and not is_running_here(job.id)
+    ) or job.status == 'failed'
+    
+    return jsonify({'success': True, 'job': job_data})
 
 @admin.route('/admin/projects/<int:project_id>')
 @login_required
@@ -424,6 +526,7 @@ def delete_project_admin(project_id):
     
     db.session.delete(project)
     db.session.commit()
+    invalidate_tags('projects')
     
     return jsonify({
         'success': True,
@@ -476,6 +579,16 @@ def admin_analytics():
         for ht in house_type_stats
     ]
     
+    # Structure dimensions, aggregated from the metric structure rows
+    structure_type_stats = db.session.query(
+        ProjectStructure.structure_type,
+        func.count(ProjectStructure.id).label('count'),
+        func.avg(ProjectStructure.length_m * ProjectStructure.width_m).label('avg_floor_area'),
+        func.avg(ProjectStructure.height_m).label('avg_height'),
+        func.sum(ProjectStructure.net_area).label('total_net_area')
+    ).group_by(ProjectStructure.structure_type)\
+     .order_by(func.count(ProjectStructure.id).desc()).limit(10).all()
+    
     return render_template('admin/analytics.html',
                          title='Analytics Dashboard',
                          daily_signups=daily_signups,
@@ -485,7 +598,8 @@ def admin_analytics():
                          active_users_today=active_users_today,
                          active_users_week=active_users_week,
                          active_users_month=active_users_month,
-                         house_type_percentages=house_type_percentages)
+                         house_type_percentages=house_type_percentages,
+                         structure_type_stats=structure_type_stats)
 
 @admin.route('/admin/prices')
 @login_required
@@ -493,22 +607,27 @@ def admin_analytics():
 def admin_prices():
     """Price management dashboard"""
     from app.utils.price_fetcher import get_current_prices, price_fetcher
+    from app.utils.price_refresher import price_refresher
     
     try:
         current_prices = get_current_prices()
         manual_prices = price_fetcher.get_manual_prices()
+        refresh_status = price_refresher.status()
         
         # Ensure all required price structures exist with defaults
         current_prices = ensure_price_structure(current_prices)
         
-        # Price history (you could store this in database)
-        price_history = get_price_history()
+        # Manual updates/resets and the materials/regions that have price history
+        price_history = get_price_audit_log()
+        series_options = get_price_series_options()
         
         return render_template('admin/prices.html',
                             title='Price Management',
                             current_prices=current_prices,
                             manual_prices=manual_prices,
-                            price_history=price_history)
+                            refresh_status=refresh_status,
+                            price_history=price_history,
+                            series_options=series_options)
     except Exception as e:
         flash(f'Error loading price data: {str(e)}', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -550,10 +669,8 @@ def update_prices():
             return jsonify({'success': False, 'error': 'No data provided'})
         
         from app.utils.price_fetcher import price_fetcher
-        updated_prices = price_fetcher.update_manual_prices(data)
-        
-        # Log the price update
-        log_price_update(current_user.id, data)
+        updated_prices = price_fetcher.update_manual_prices(data, updated_by=current_user.id)
+        invalidate_tags('prices')
         
         return jsonify({
             'success': True,
@@ -570,18 +687,12 @@ def update_prices():
 def reset_prices():
     """Reset to automatic pricing"""
     try:
-        import os
-        manual_cache_path = 'manual_price_cache.json'
+        from app.utils.price_fetcher import get_current_prices, price_fetcher
+        price_fetcher.clear_manual_prices(updated_by=current_user.id)
+        invalidate_tags('prices')
         
-        if os.path.exists(manual_cache_path):
-            os.remove(manual_cache_path)
-            
-        from app.utils.price_fetcher import get_current_prices
         current_prices = get_current_prices()
         
-        # Log the reset
-        log_price_update(current_user.id, {'action': 'reset_to_auto'})
-        
         return jsonify({
             'success': True,
             'message': 'Prices reset to automatic mode!',
@@ -595,58 +706,64 @@ def reset_prices():
 @login_required
 @admin_required
 def price_history():
-    """Get price update history"""
-    history = get_price_history()
+    """Get manual price update history, newest first (paged with limit/offset)"""
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    offset = request.args.get('offset', 0, type=int)
+    history = get_price_audit_log(limit=limit, offset=offset)
     return jsonify({'success': True, 'history': history})
 
+@admin.route('/admin/prices/series')
+@login_required
+@admin_required
+def price_series():
+    """Price trend of one material/region: raw points or daily/weekly min/avg/max"""
+    material = request.args.get('material', '9_inch_hollow')
+    region = request.args.get('region', NATIONAL)
+    bucket = request.args.get('bucket', 'day')
+    
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+        series = get_price_series(material, region, start=start, end=end, bucket=bucket)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'material': material,
+        'region': region,
+        'bucket': bucket,
+        'series': series
+    })
+
 @admin.route('/admin/prices/refresh', methods=['POST'])
 @login_required
 @admin_required
 def refresh_prices():
-    """Manually refresh prices from sources"""
+    """Start a refresh from sources in the background"""
     try:
         from app.utils.price_fetcher import update_prices_manually
+        from app.utils.price_refresher import price_refresher
         prices = update_prices_manually()
         
         return jsonify({
             'success': True,
-            'message': 'Prices refreshed from sources!',
-            'prices': prices
+            'message': 'Price refresh started',
+            'prices': prices,
+            'status': price_refresher.status()
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-# Helper functions
-def get_price_history():
-    """Get price update history (simplified - in production, use database)"""
-    try:
-        with open('price_update_history.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+@admin.route('/admin/prices/status')
+@login_required
+@admin_required
+def price_refresh_status():
+    """Background price refresher status"""
+    from app.utils.price_refresher import price_refresher
+    return jsonify({'success': True, 'status': price_refresher.status()})
 
-def log_price_update(user_id, update_data):
-    """Log price updates for audit trail"""
-    try:
-        history = get_price_history()
-        
-        history_entry = {
-            'timestamp': datetime.utcnow().isoformat(),
-            'user_id': user_id,
-            'action': 'manual_update' if 'action' not in update_data else update_data['action'],
-            'data': update_data
-        }
-        
-        history.insert(0, history_entry)  # Add to beginning
-        history = history[:50]  # Keep only last 50 entries
-        
-        with open('price_update_history.json', 'w') as f:
-            json.dump(history, f, indent=2)
-            
-    except Exception as e:
-        print(f"Error logging price update: {e}")
-        
 @admin.route('/api/admin/stats')
 @login_required
 @admin_required
@@ -675,4 +792,23 @@ def admin_stats_api():
         'today_users': today_users,
         'today_projects': today_projects,
         'recent_signups': recent_signups
+    })
+
+@admin.route('/api/admin/cache-stats')
+@login_required
+@admin_required
+def admin_cache_stats_api():
+    """Per-namespace cache metrics; ?format=prometheus for the Prometheus text format"""
+    metrics = cache_metrics()
+    
+    if request.args.get('format') == 'prometheus':
+        return current_app.response_class(
+            cache_metrics_prometheus(metrics),
+            mimetype='text/plain; version=0.0.4'
+        )
+    
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'namespaces': metrics
     })
\ No newline at end of file
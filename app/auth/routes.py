@@ -6,6 +6,7 @@ import uuid
 from PIL import Image
 from app import db
 from app.utils.notifications import create_welcome_notifications
+from app.utils.cache import invalidate_tags
 from app.models import User, Project, Notification
 from app.auth.forms import (LoginForm, RegistrationForm, UpdateAccountForm, 
                            UserPreferencesForm, ChangePasswordForm, ProfilePictureForm)
@@ -54,6 +55,7 @@ def register():
         user.set_password(form.password.data)
         db.session.add(user)
         db.session.commit()
+        invalidate_tags('users')
         
         # Create welcome notifications
         create_welcome_notifications(user)
@@ -356,6 +358,7 @@ def delete_account():
         username = current_user.username
         db.session.delete(current_user)
         db.session.commit()
+        invalidate_tags('users', 'projects')
         
         logout_user()
         flash(f'Account "{username}" has been permanently deleted.', 'success')
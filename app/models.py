@@ -2,7 +2,11 @@ import uuid
 from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 from app import db, login_manager
+from app.utils.cache import invalidate_tags
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -170,6 +174,10 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+# Project columns set by store_calculation() and pin_prices()
+CALCULATION_COLUMNS = ('total_blocks', 'total_area', 'calculation_data', 'calculation_hash',
+                       'calculation_version', 'price_snapshot_id')
+
 class Project(db.Model):
     __tablename__ = 'projects'
     
@@ -191,6 +199,14 @@ class Project(db.Model):
     total_blocks = db.Column(db.Integer, default=0)
     total_area = db.Column(db.Float, default=0.0)
     
+    # Full calculation result plus the input hash and standards version it
+    # was computed for, so readers can serve it without recalculating
+    calculation_data = db.Column(db.JSON)
+    calculation_hash = db.Column(db.String(64))
+    calculation_version = db.Column(db.String(32))
+    # Price snapshot the project's costs are calculated with, until it is repriced
+    price_snapshot_id = db.Column(db.Integer, db.ForeignKey('price_snapshots.id'), nullable=True)
+    
     # Privacy settings
     is_public = db.Column(db.Boolean, default=False)
     is_private = db.Column(db.Boolean, default=False)
@@ -203,6 +219,8 @@ class Project(db.Model):
     # Relationships
     shares = db.relationship('ProjectShare', backref='project', lazy='dynamic', cascade='all, delete-orphan')
     collaborators = db.relationship('ProjectCollaborator', backref='project', lazy='dynamic', cascade='all, delete-orphan')
+    structure_records = db.relationship('ProjectStructure', backref='project', lazy='dynamic',
+                                        cascade='all, delete-orphan', order_by='ProjectStructure.position')
     
     def get_collaborators(self):
         """Get all collaborators including owner"""
@@ -309,6 +327,10 @@ class Project(db.Model):
         
         db.session.commit()
     
+    def get_block_type(self):
+        """Block type the project is calculated with"""
+        return (self.structures_data or {}).get('block_type', '9_inch_hollow')
+    
     def calculate_blocks(self):
         """Calculate total blocks needed for this project - UPDATED without price"""
         try:
@@ -316,13 +338,11 @@ class Project(db.Model):
             
             calculator = BlockCalculator(
                 self.structures_data,
-                block_type=self.structures_data.get('block_type', '9_inch_hollow')
+                block_type=self.get_block_type()
             )
             
-            result = calculator.calculate()
-            
-            self.total_blocks = result['total_blocks']
-            self.total_area = result['total_area']
+            result = calculator.calculate_cached()
+            self.store_calculation(result, calculator.cache_key())
             
             return self.total_blocks
             
@@ -330,8 +350,140 @@ class Project(db.Model):
             print(f"Error calculating blocks: {e}")
             self.total_blocks = 0
             self.total_area = 0
+            self.calculation_data = None
+            self.calculation_hash = None
+            self.calculation_version = None
             return 0
     
+    def store_calculation(self, result, calculation_hash=None):
+        """Persist a calculation result together with its staleness markers"""
+        from app.utils.calculator import calculation_key, STANDARDS_VERSION
+        
+        if calculation_hash is None:
+            calculation_hash = calculation_key(self.structures_data, self.get_block_type())
+        
+        self.total_blocks = result['total_blocks']
+        self.total_area = result['total_area']
+        self.calculation_data = result
+        self.calculation_hash = calculation_hash
+        self.calculation_version = STANDARDS_VERSION
+        if self.price_snapshot_id is None:
+            self.pin_prices()
+    
+    def pin_prices(self, snapshot_id=None):
+        """Price the project with a snapshot (the current one by default) until it is repriced"""
+        from app.utils.price_store import price_store
+        
+        if snapshot_id is None:
+            # Looking up the snapshot must not flush this project's unsaved calculation
+            with db.session.no_autoflush:
+                snapshot_id = price_store.current_snapshot_id()
+        self.price_snapshot_id = snapshot_id
+        return self.price_snapshot_id
+    
+    def get_price_snapshot_id(self):
+        """Pinned price snapshot id, pinning the current snapshot on first use"""
+        if self.price_snapshot_id is None and self.pin_prices() is not None:
+            Project.write_calculations([self])
+        return self.price_snapshot_id
+    
+    def is_calculation_stale(self):
+        """True if the stored calculation no longer matches the inputs or standards"""
+        from app.utils.calculator import calculation_key, STANDARDS_VERSION
+        
+        if not self.calculation_data or self.calculation_version != STANDARDS_VERSION:
+            return True
+        return self.calculation_hash != calculation_key(self.structures_data or {}, self.get_block_type())
+    
+    def normalize_structures(self, specs=None):
+        """Rewrite the metric ProjectStructure rows from structures_data
+        
+        Called whenever structures_data is saved. specs are the already
+        parsed StructureSpecs, if the caller validated the input.
+        """
+        from app.utils.structure_specs import parse_structures_data
+        
+        if specs is None:
+            specs = parse_structures_data(self.structures_data)
+        
+        if self.id is not None:
+            ProjectStructure.query.filter_by(project_id=self.id).delete()
+        
+        for position, spec in enumerate(specs):
+            self.structure_records.append(ProjectStructure(position=position, **spec.to_metric_dict()))
+    
+    def has_valid_structures(self):
+        """False if structures_data fails validation (rows saved before it was enforced)"""
+        from app.utils.structure_specs import parse_structures_data, StructureValidationError
+        
+        try:
+            parse_structures_data(self.structures_data)
+        except StructureValidationError:
+            return False
+        return True
+    
+    def get_calculation(self):
+        """Return the stored calculation result, recalculating lazily if stale
+        
+        A stale project whose structures_data no longer validates keeps its
+        stored result, which is None if it was never calculated.
+        """
+        if self.is_calculation_stale() and self.has_valid_structures():
+            self.calculate_blocks()
+            Project.write_calculations([self])
+        return self.calculation_data
+    
+    @classmethod
+    def refresh_stale_calculations(cls, projects):
+        """Recalculate the stale projects of a list in one vectorised pass
+        
+        Projects whose structures_data no longer validates keep their stored
+        result, as in get_calculation().
+        """
+        from app.utils.batch_calculator import calculate_many
+        
+        stale_projects = [project for project in projects
+                          if project.is_calculation_stale() and project.has_valid_structures()]
+        if not stale_projects:
+            return
+        results = calculate_many(
+            [project.structures_data for project in stale_projects],
+            block_type=[project.get_block_type() for project in stale_projects]
+        )
+        for project, result in zip(stale_projects, results):
+            project.store_calculation(result)
+        cls.write_calculations(stale_projects)
+    
+    @classmethod
+    def write_calculations(cls, projects):
+        """Save the calculation columns of projects in a transaction of their own
+        
+        Used where a read recalculates or pins prices lazily, so GET requests
+        neither commit the request's session (and whatever else is pending
+        in it) nor touch updated_at. If the write fails the new values are
+        only kept in memory and are recalculated on a later read.
+        """
+        rows = [
+            dict({column: getattr(project, column) for column in CALCULATION_COLUMNS},
+                 project_id=project.id, updated_at=project.updated_at)
+            for project in projects if project.id is not None
+        ]
+        if not rows:
+            return
+        
+        table = cls.__table__
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.update().where(table.c.id == bindparam('project_id')), rows)
+        except Exception as e:
+            print(f"Could not save recalculated projects: {e}")
+            return
+        
+        # Already saved: the request's session has nothing left to flush for them
+        for project in projects:
+            for column in CALCULATION_COLUMNS:
+                set_committed_value(project, column, getattr(project, column))
+    
     def generate_share_token(self):
         """Generate a unique share token for public access"""
         import secrets
@@ -359,6 +511,8 @@ class Project(db.Model):
             user_id=user_id,
             team_id=team_id
         )
+        if project.has_valid_structures():
+            project.normalize_structures()
         
         if structures_data.get('structures'):
             project.calculate_blocks()
@@ -378,6 +532,9 @@ class Project(db.Model):
             # Remove shares
             ProjectShare.query.filter_by(project_id=self.id).delete()
             
+            # Remove metric structure rows
+            ProjectStructure.query.filter_by(project_id=self.id).delete()
+            
             # Remove notifications related to this project
             Notification.query.filter_by(
                 related_id=self.id, 
@@ -387,6 +544,7 @@ class Project(db.Model):
             # Now delete the project
             db.session.delete(self)
             db.session.commit()
+            invalidate_tags('projects')
             return True
         except Exception as e:
             db.session.rollback()
@@ -695,6 +853,7 @@ class Team(db.Model):
             db.session.rollback()
             print(f"Error deleting team: {e}")
             return False
+    
     def get_team_projects(self):
         """Get all projects associated with this team"""
         return Project.query.filter_by(team_id=self.id).all()
@@ -880,6 +1039,214 @@ class ProjectCollaborator(db.Model):
     
     __table_args__ = (db.UniqueConstraint('project_id', 'user_id', name='unique_project_collaborator'),)
 
+class ProjectStructure(db.Model):
+    """One structure of a project with its dimensions normalized to meters
+    
+    structures_data keeps the units the user entered for display; these rows
+    are rewritten from it on every save so analytics can aggregate
+    dimensions and areas directly in SQL.
+    """
+    __tablename__ = 'project_structures'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False, default=0)  # order within structures_data
+    
+    name = db.Column(db.String(100))
+    structure_type = db.Column(db.String(50), index=True)
+    unit = db.Column(db.String(20))  # unit the user entered
+    
+    # Everything below is in meters / square meters
+    length_m = db.Column(db.Float, nullable=False)
+    width_m = db.Column(db.Float, nullable=False)
+    height_m = db.Column(db.Float, nullable=False)
+    wall_area = db.Column(db.Float, nullable=False)
+    openings_area = db.Column(db.Float, nullable=False, default=0.0)
+    net_area = db.Column(db.Float, nullable=False)
+    opening_count = db.Column(db.Integer, default=0)
+    
+    def __repr__(self):
+        return f'<ProjectStructure {self.project_id}:{self.position} {self.structure_type}>'
+
+class RecalculationJob(db.Model):
+    __tablename__ = 'recalculation_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), default='pending')  # pending, running, completed, failed
+    filters = db.Column(db.JSON, default=dict)  # house_type, team_id, created_after, created_before
+    standards_version = db.Column(db.String(32))
+    
+    # Progress - last_project_id is the resume cursor (projects are processed in id order)
+    total_projects = db.Column(db.Integer, default=0)
+    processed_projects = db.Column(db.Integer, default=0)
+    failed_projects = db.Column(db.Integer, default=0)
+    last_project_id = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    
+    # Foreign keys
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    
+    # Timestamps - updated_at doubles as the worker heartbeat
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    # Relationships
+    user = db.relationship('User', backref='recalculation_jobs')
+    
+    def get_progress_percentage(self):
+        """Percentage of matching projects processed so far"""
+        if not self.total_projects:
+            return 100 if self.status == 'completed' else 0
+        return round(min(100, self.processed_projects * 100 / self.total_projects), 1)
+    
+    def is_interrupted(self, stale_after):
+        """True if the job is pending/running but its worker stopped heartbeating"""
+        return self.status in ('pending', 'running') and (datetime.utcnow() - self.updated_at) > stale_after
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'filters': self.filters or {},
+            'standards_version': self.standards_version,
+            'total_projects': self.total_projects,
+            'processed_projects': self.processed_projects,
+            'failed_projects': self.failed_projects,
+            'last_project_id': self.last_project_id,
+            'progress': self.get_progress_percentage(),
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<RecalculationJob {self.id} {self.status}>'
+
+class PriceSnapshot(db.Model):
+    """One immutable version of the material prices.
+    
+    Rows are only ever inserted, so the highest id is the store's version.
+    The latest 'auto' row holds the prices fetched from the sources. The
+    latest 'manual' row is the admin override while it has prices and has
+    not expired; a manual row without prices clears the override.
+    """
+    __tablename__ = 'price_snapshots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False, index=True)  # auto, manual
+    prices = db.Column(db.JSON)
+    data_source = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime)  # manual overrides only
+    
+    # Foreign keys
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    
+    def is_active_override(self, now=None):
+        """True if this is a manual snapshot that still overrides the fetched prices"""
+        return (self.kind == 'manual' and self.prices is not None and
+                (self.expires_at is None or self.expires_at > (now or datetime.utcnow())))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'data_source': self.data_source,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'created_by': self.created_by
+        }
+    
+    def __repr__(self):
+        return f'<PriceSnapshot {self.id} {self.kind}>'
+
+class PricePoint(db.Model):
+    """Append-only price history: one material price in one region at one time.
+    
+    A point is written for every material (region 'national') and every
+    regional range of each fetched or manual snapshot, and never updated or
+    pruned.
+    """
+    __tablename__ = 'price_points'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    material = db.Column(db.String(50), nullable=False)
+    region = db.Column(db.String(50), nullable=False, default='national')
+    price = db.Column(db.Float, nullable=False)  # average price
+    price_min = db.Column(db.Float)
+    price_max = db.Column(db.Float)
+    source = db.Column(db.String(10), nullable=False)  # auto, manual
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Foreign keys
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('price_snapshots.id'))
+    
+    __table_args__ = (db.Index('ix_price_points_material_region_recorded_at', 'material', 'region', 'recorded_at'),)
+    
+    def to_dict(self):
+        return {
+            'material': self.material,
+            'region': self.region,
+            'price': self.price,
+            'price_min': self.price_min,
+            'price_max': self.price_max,
+            'source': self.source,
+            'recorded_at': self.recorded_at.isoformat(),
+            'snapshot_id': self.snapshot_id
+        }
+    
+    def __repr__(self):
+        return f'<PricePoint {self.material} {self.region} {self.price}>'
+
+class Lease(db.Model):
+    """A named, expiring lock shared by every worker process through the database.
+    
+    At most one holder owns a lease until it is released or expires, so a
+    holder that dies without releasing only blocks the others for the TTL.
+    """
+    __tablename__ = 'leases'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(200), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    @classmethod
+    def acquire(cls, name, holder, ttl):
+        """Take or extend the lease for ttl (a timedelta); returns True if holder owns it"""
+        now = datetime.utcnow()
+        expires_at = now + ttl
+        
+        # Atomic: only matches if the lease expired or is already ours
+        updated = cls.query.filter(
+            cls.name == name,
+            db.or_(cls.expires_at <= now, cls.holder == holder)
+        ).update({'holder': holder, 'expires_at': expires_at}, synchronize_session=False)
+        if updated:
+            db.session.commit()
+            return True
+        
+        # No row yet - the primary key lets only one concurrent insert win
+        try:
+            db.session.add(cls(name=name, holder=holder, expires_at=expires_at))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+    
+    @classmethod
+    def release(cls, name, holder):
+        """Give the lease up early if holder still owns it"""
+        cls.query.filter_by(name=name, holder=holder).delete(synchronize_session=False)
+        db.session.commit()
+    
+    def __repr__(self):
+        return f'<Lease {self.name} {self.holder}>'
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
\ No newline at end of file
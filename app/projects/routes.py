@@ -2,7 +2,7 @@ from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from app import db
 from app.utils.structure_templates import get_house_type_template, STRUCTURE_TYPES, SUB_STRUCTURE_TYPES, MEASUREMENT_UNITS
-from flask import render_template, redirect, url_for, flash, request, jsonify, Blueprint, send_file
+from flask import render_template, redirect, url_for, flash, request, jsonify, Blueprint, send_file, Response, stream_with_context
 import json
 import csv
 import io
@@ -10,10 +10,21 @@ from app.models import Project, ProjectShare, Team, TeamMember, ProjectCollabora
 from app.utils.reports import ReportGenerator, generate_comparison_report
 from app.utils.reports import calculate_efficiency_score
 from app.utils.calculator import BlockCalculator
+from app.utils.cost_matrix import CostMatrix, LEVELS, regional_price_table
+from app.utils.cost_simulation import DEFAULT_SAMPLES, MAX_SAMPLES, simulate_project_cost
+from app.utils.price_store import price_store
+from app.utils.structure_specs import parse_structures_data, structure_rows, StructureValidationError
 from app.utils.notifications import NotificationManager
+from app.utils.cache import invalidate_tags
 import base64
 projects = Blueprint('projects', __name__)
 
+
+@projects.errorhandler(StructureValidationError)
+def structure_validation_error(error):
+    """Reject invalid structures with every bad field listed by path"""
+    return jsonify(error.to_dict()), 400
+
 # Update the dashboard route in projects/routes.py
 
 @projects.route('/dashboard')
@@ -65,6 +76,7 @@ def dashboard():
 def new_project():
     if request.method == 'POST':
         data = request.get_json()
+        specs = parse_structures_data(data.get('structures', {}))
         
         # Create new project
         project = Project(
@@ -74,6 +86,7 @@ def new_project():
             user_id=current_user.id,
             team_id=data.get('team_id')
         )
+        project.normalize_structures(specs)
         
         # Set privacy settings
         privacy_level = data.get('privacy', 'private')
@@ -87,6 +100,7 @@ def new_project():
         
         db.session.add(project)
         db.session.commit()
+        invalidate_tags('projects')
         # Send project created notification - FIXED
         try:
             # Method 1: Using the NotificationManager if it exists
@@ -182,9 +196,8 @@ def view_project(project_id):
         flash('You do not have permission to view this project.', 'danger')
         return redirect(url_for('projects.dashboard'))
     
-    # Recalculate if needed (in case calculation methods have updated)
-    if not project.total_blocks and project.structures_data.get('structures'):
-        project.calculate_blocks()
+    # Recalculate if the stored result is stale (inputs or standards changed)
+    project.get_calculation()
     
     # Get collaborators information
     collaborators = project.get_collaborators()
@@ -207,17 +220,21 @@ def calculate_project(project_id):
         return jsonify({'success': False, 'error': 'Permission denied'})
     
     data = request.get_json()
+    specs = parse_structures_data(data['structures']) if 'structures' in data else None
     
     # Update project data
     project.title = data.get('title', project.title)
     project.house_type = data.get('house_type', project.house_type)
     project.structures_data = data.get('structures', project.structures_data)
     project.updated_at = datetime.utcnow()
+    if specs is not None:
+        project.normalize_structures(specs)
     
     # Calculate blocks
     total_blocks = project.calculate_blocks()
     
     db.session.commit()
+    invalidate_tags('projects')
     
     return jsonify({
         'success': True,
@@ -233,11 +250,16 @@ def update_project(project_id):
         return jsonify({'success': False, 'error': 'Permission denied'})
     
     data = request.get_json()
+    specs = parse_structures_data(data['structures']) if 'structures' in data else None
+    
     project.title = data.get('title', project.title)
     project.structures_data = data.get('structures', project.structures_data)
     project.updated_at = datetime.utcnow()
+    if specs is not None:
+        project.normalize_structures(specs)
     
     db.session.commit()
+    invalidate_tags('projects')
     return jsonify({'success': True})
 
 @projects.route('/project/<int:project_id>/delete', methods=['POST'])
@@ -324,6 +346,7 @@ def bulk_delete_projects():
             deleted_count += 1
         
         db.session.commit()
+        invalidate_tags('projects')
         
         # Send bulk delete notification
         if deleted_count > 0:
@@ -377,6 +400,8 @@ def generate_materials_report(project_id):
     
     report_generator = ReportGenerator(project)
     materials = report_generator.generate_materials_list()
+    if materials is None:
+        return jsonify({'success': False, 'error': 'Project has no calculation'})
     
     
     return jsonify({
@@ -446,6 +471,7 @@ def change_project_privacy(project_id):
     privacy_level = data.get('privacy', 'private')
     
     project.set_privacy(privacy_level)
+    invalidate_tags('projects')
     
     return jsonify({
         'success': True,
@@ -466,6 +492,7 @@ def edit_project(project_id):
     
     if request.method == 'POST':
         data = request.get_json()
+        specs = parse_structures_data(data['structures']) if 'structures' in data else None
         
          # Update project data
         project.title = data.get('title', project.title)
@@ -473,6 +500,8 @@ def edit_project(project_id):
         project.house_type = data.get('house_type', project.house_type)
         project.structures_data = data.get('structures', project.structures_data)
         project.updated_at = datetime.utcnow()
+        if specs is not None:
+            project.normalize_structures(specs)
         
         # Update privacy settings
         privacy_level = data.get('privacy', 'private')
@@ -483,6 +512,7 @@ def edit_project(project_id):
             project.calculate_blocks()
         
         db.session.commit()
+        invalidate_tags('projects')
         
         return jsonify({
             'success': True, 
@@ -526,8 +556,9 @@ def get_project_efficiency(project_id):
     if project.author != current_user:
         return jsonify({'success': False, 'error': 'Permission denied'})
     
-    calculator = BlockCalculator(project.structures_data)
-    calculation = calculator.calculate()
+    calculation = project.get_calculation()
+    if not calculation:
+        return jsonify({'success': False, 'error': 'Project has no calculation'})
     
     efficiency_score = calculate_efficiency_score(calculation)
     
@@ -539,6 +570,132 @@ def get_project_efficiency(project_id):
         'waste_percentage': calculation['waste_percentage']
     })
 
+@projects.route('/api/project/<int:project_id>/regional-costs')
+@login_required
+def get_project_regional_costs(project_id):
+    """Project cost for every region and block type (low/avg/high) with its pinned prices"""
+    project = Project.query.get_or_404(project_id)
+    if not project.can_view(current_user):
+        return jsonify({'success': False, 'error': 'Permission denied'})
+    
+    level = request.args.get('level', 'avg')
+    if level not in LEVELS:
+        return jsonify({'success': False, 'error': f"level must be one of {', '.join(LEVELS)}"}), 400
+    
+    calculation = project.get_calculation()
+    if not calculation:
+        return jsonify({'success': False, 'error': 'Project has no calculation'})
+    
+    snapshot_id = project.get_price_snapshot_id()
+    snapshot = price_store.snapshot(snapshot_id) if snapshot_id is not None else None
+    matrix = CostMatrix([calculation], [regional_price_table(snapshot_id)])
+    return jsonify({
+        'success': True,
+        'project_id': project.id,
+        'priced_at': snapshot['created_at'].isoformat() if snapshot else None,
+        'current_price_snapshot_id': price_store.current_snapshot_id(),
+        **matrix.project_summary(0, level)
+    })
+
+
+@projects.route('/api/project/<int:project_id>/cost-simulation')
+@login_required
+def get_project_cost_simulation(project_id):
+    """P10/P50/P90 total cost from a Monte Carlo simulation over prices, region and waste"""
+    project = Project.query.get_or_404(project_id)
+    if not project.can_view(current_user):
+        return jsonify({'success': False, 'error': 'Permission denied'})
+    
+    region = request.args.get('region') or None
+    if region is not None and region not in regional_price_table(project.get_price_snapshot_id()).regions:
+        return jsonify({'success': False, 'error': f'Unknown region: {region}'}), 400
+    
+    samples = request.args.get('samples', DEFAULT_SAMPLES, type=int)
+    if not 1 <= samples <= MAX_SAMPLES:
+        return jsonify({'success': False, 'error': f'samples must be between 1 and {MAX_SAMPLES}'}), 400
+    
+    simulation = simulate_project_cost(project, region=region, samples=samples)
+    if simulation is None:
+        return jsonify({'success': False, 'error': 'Project has no calculation'})
+    
+    return jsonify({'success': True, 'project_id': project.id, **simulation})
+
+
+@projects.route('/api/projects/regional-costs')
+@login_required
+def get_portfolio_regional_costs():
+    """Cheapest region and block type for each of the user's projects and for all of them"""
+    level = request.args.get('level', 'avg')
+    if level not in LEVELS:
+        return jsonify({'success': False, 'error': f"level must be one of {', '.join(LEVELS)}"}), 400
+    
+    user_projects = current_user.projects.order_by(Project.updated_at.desc()).all()
+    
+    # Recalculate stale projects in one vectorised pass, reuse the rest
+    Project.refresh_stale_calculations(user_projects)
+    
+    # Legacy projects that never calculated and no longer validate are left out
+    user_projects = [project for project in user_projects if project.calculation_data]
+    
+    # Projects from before price pinning get the current snapshot
+    unpinned = [project for project in user_projects if project.price_snapshot_id is None]
+    for project in unpinned:
+        project.pin_prices()
+    Project.write_calculations(unpinned)
+    
+    tables = [regional_price_table(project.price_snapshot_id) for project in user_projects]
+    summary = CostMatrix([project.calculation_data for project in user_projects], tables).portfolio_summary(level)
+    for project, cheapest in zip(user_projects, summary['projects']):
+        cheapest['project_id'] = project.id
+        cheapest['title'] = project.title
+    
+    return jsonify({'success': True, **summary})
+
+def reprice_projects(projects_to_reprice):
+    """Pin projects to the current price snapshot; returns (snapshot id, repriced count)"""
+    snapshot_id = price_store.current_snapshot_id()
+    repriced = [project for project in projects_to_reprice if project.price_snapshot_id != snapshot_id]
+    for project in repriced:
+        project.pin_prices(snapshot_id)
+    db.session.commit()
+    return snapshot_id, len(repriced)
+
+
+@projects.route('/project/<int:project_id>/reprice', methods=['POST'])
+@login_required
+def reprice_project(project_id):
+    """Move the project's costs to the current prices"""
+    project = Project.query.get_or_404(project_id)
+    if not project.can_edit(current_user):
+        return jsonify({'success': False, 'error': 'Permission denied'})
+    
+    snapshot_id, repriced_count = reprice_projects([project])
+    return jsonify({'success': True, 'price_snapshot_id': snapshot_id, 'repriced_count': repriced_count})
+
+
+@projects.route('/projects/bulk/reprice', methods=['POST'])
+@login_required
+def bulk_reprice_projects():
+    """Move several projects' costs to the current prices"""
+    data = request.get_json()
+    project_ids = data.get('project_ids', [])
+    
+    if not project_ids:
+        return jsonify({'success': False, 'error': 'No projects selected'})
+    
+    projects_to_reprice = Project.query.filter(
+        Project.id.in_(project_ids),
+        Project.user_id == current_user.id
+    ).all()
+    
+    snapshot_id, repriced_count = reprice_projects(projects_to_reprice)
+    return jsonify({
+        'success': True,
+        'price_snapshot_id': snapshot_id,
+        'repriced_count': repriced_count,
+        'message': f'Repriced {repriced_count} projects'
+    })
+
 @projects.route('/projects/bulk/duplicate', methods=['POST'])
 @login_required
 def bulk_duplicate_projects():
@@ -567,6 +724,9 @@ def bulk_duplicate_projects():
                 structures_data=project.structures_data.copy(),
                 user_id=current_user.id
             )
+            # Legacy structures_data that fails validation is copied as it is
+            if new_project.has_valid_structures():
+                new_project.normalize_structures()
             
             # Recalculate for the new project
             if new_project.structures_data.get('structures'):
@@ -577,6 +737,8 @@ def bulk_duplicate_projects():
             new_project_ids.append(new_project.id)
         
         db.session.commit()
+        if duplicated_count:
+            invalidate_tags('projects')
         
         flash(f'Successfully duplicated {duplicated_count} projects.', 'success')
         return jsonify({
@@ -635,15 +797,8 @@ def bulk_export_projects():
                 csv_writer.writerow(['Structures'])
                 csv_writer.writerow(['Name', 'Type', 'Length', 'Width', 'Height', 'Unit'])
                 
-                for structure in project.structures_data.get('structures', []):
-                    csv_writer.writerow([
-                        structure.get('name', ''),
-                        structure.get('type', ''),
-                        structure.get('length', ''),
-                        structure.get('width', ''),
-                        structure.get('height', ''),
-                        structure.get('unit', '')
-                    ])
+                for row in structure_rows(project.structures_data):
+                    csv_writer.writerow(row)
                 
                 zip_file.writestr(f"{project.title}.csv", csv_output.getvalue())
         
@@ -667,6 +822,10 @@ def get_house_type_template_api(house_type):
     """API endpoint to get auto-fill template"""
     try:
         template = get_house_type_template(house_type)
+        
+        # Precomputed totals so the builder does not recalculate an untouched template
+        from app.utils.template_results import get_template_totals
+        template = dict(template, calculations=get_template_totals(house_type))
         print(f"DEBUG: Loading template for {house_type}: {template}")  # Debug
         return jsonify(template)
     except Exception as e:
@@ -678,14 +837,16 @@ def get_house_type_template_api(house_type):
 @login_required
 def calculate_preview():
     """Calculate blocks for preview without saving - UPDATED without price"""
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Request body must be a JSON object'}), 400
     structures_data = data.get('structures', {})
     
     print(f"DEBUG: Starting calculation with structures: {structures_data}")
     
     from app.utils.calculator import BlockCalculator
     calculator = BlockCalculator(structures_data)
-    result = calculator.calculate()
+    result = calculator.calculate_cached()
     
     print(f"DEBUG: Calculation result: {result}")
     
@@ -696,6 +857,53 @@ def calculate_preview():
         'cement_bags': result.get('cement_bags', 0),
         'sand_trucks': result.get('sand_trucks', 0)
     })
+
+
+@projects.route('/api/calculate-preview/stream', methods=['POST'])
+@login_required
+def calculate_preview_stream():
+    """Stream per-structure results as NDJSON for very large projects
+    
+    One 'structure' record is written per structure with running totals,
+    followed by a final 'summary' record, so time-to-first-byte and memory
+    do not grow with the number of structures.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Request body must be a JSON object'}), 400
+    structures_data = data.get('structures', {})
+    calculator = BlockCalculator(structures_data)
+    calculator.validate()  # before the response starts
+    
+    def generate():
+        total_blocks = 0
+        total_net_area = 0
+        structure_count = 0
+        
+        try:
+            for index, (structure_blocks, structure_area, net_area,
+                        openings_area, breakdown_entry) in enumerate(calculator.iter_structures(memoize=False)):
+                total_blocks += structure_blocks
+                total_net_area += net_area
+                structure_count += 1
+                
+                record = {'record': 'structure', 'index': index}
+                record.update(breakdown_entry)
+                record['running_blocks'] = total_blocks
+                record['running_area'] = total_net_area
+                yield json.dumps(record, default=str) + '\n'
+            
+            summary = calculator.summarize(total_blocks, total_net_area)
+            summary['record'] = 'summary'
+            summary['structure_count'] = structure_count
+            yield json.dumps(summary, default=str) + '\n'
+            
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield json.dumps({'record': 'error', 'index': structure_count, 'error': str(e)}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # Add API endpoint for structured data
 @projects.route('/api/structure-categories')
 @login_required
@@ -724,6 +932,7 @@ def share_project(project_id):
     share_url = project.get_share_url()
     
     db.session.commit()
+    invalidate_tags('projects')
     
     return jsonify({
         'success': True, 
@@ -741,6 +950,7 @@ def unshare_project(project_id):
     
     project.is_public = False
     db.session.commit()
+    invalidate_tags('projects')
     
     return jsonify({
         'success': True, 
@@ -800,15 +1010,8 @@ def export_project_csv(project_id):
     writer.writerow(['Structures'])
     writer.writerow(['Name', 'Type', 'Length', 'Width', 'Height', 'Unit'])
     
-    for structure in project.structures_data.get('structures', []):
-        writer.writerow([
-            structure.get('name', ''),
-            structure.get('type', ''),
-            structure.get('length', ''),
-            structure.get('width', ''),
-            structure.get('height', ''),
-            structure.get('unit', '')
-        ])
+    for row in structure_rows(project.structures_data):
+        writer.writerow(row)
     
     # Convert to bytes for response
     output.seek(0)
@@ -837,6 +1040,9 @@ def duplicate_project(project_id):
         structures_data=original_project.structures_data.copy(),
         user_id=current_user.id
     )
+    # Legacy structures_data that fails validation is copied as it is
+    if new_project.has_valid_structures():
+        new_project.normalize_structures()
     
     # Recalculate for the new project
     if new_project.structures_data.get('structures'):
@@ -844,6 +1050,7 @@ def duplicate_project(project_id):
     
     db.session.add(new_project)
     db.session.commit()
+    invalidate_tags('projects')
     
     flash('Project duplicated successfully!', 'success')
     return jsonify({
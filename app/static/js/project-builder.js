@@ -500,7 +500,16 @@ class ProjectBuilder {
                 this.showError('No structures found in template');
             }
             
-            this.updateCalculation();
+            // Untouched templates come with their totals precomputed
+            const blockType = document.getElementById('blockType')?.value || '9_inch_hollow';
+            const wastePercentage = parseInt(document.getElementById('wastePercentage')?.value) || 10;
+            const precomputed = template.calculations?.[blockType]?.[wastePercentage];
+            
+            if (precomputed) {
+                this.displayResults(precomputed);
+            } else {
+                this.updateCalculation();
+            }
             
         } catch (error) {
             console.error('Auto-fill error:', error);
@@ -0,0 +1,278 @@
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app.utils.cache import calculation_cache
+from app.utils.calculator import BlockCalculator, calculation_key, STANDARDS_VERSION
+from app.utils.structure_specs import parse_structures_data
+
+
+class BatchBlockCalculator:
+    """Calculate many projects at once with NumPy.
+
+    All structures of all projects are flattened into column arrays so wall
+    area, net area, blocks, waste, cement and sand are computed in a handful
+    of array operations. Sums are accumulated in the same order as
+    BlockCalculator.calculate(), so the results are identical to it.
+    """
+
+    def __init__(self, projects_data, block_type='9_inch_hollow'):
+        self.projects_data = list(projects_data)
+
+        # A single block type for every project, or one per project
+        if isinstance(block_type, str):
+            self.block_types = [block_type] * len(self.projects_data)
+        else:
+            self.block_types = list(block_type)
+
+        if len(self.block_types) != len(self.projects_data):
+            raise ValueError("block_type must be a string or match the number of projects")
+
+        self._flatten()
+
+    def _flatten(self):
+        """Flatten structures and openings (already in metres) into column arrays"""
+        block_areas = {}
+        project_block_area = []
+        waste_percentages = []
+
+        structures = []
+        structure_project = []
+        lengths, widths, heights = [], [], []
+
+        openings = []
+        opening_structure = []
+        opening_widths, opening_heights, quantities = [], [], []
+
+        for project_index, structures_data in enumerate(self.projects_data):
+            block_type = self.block_types[project_index]
+            if block_type not in block_areas:
+                block_areas[block_type] = BlockCalculator({}, block_type=block_type).calculate_block_area()
+            project_block_area.append(block_areas[block_type])
+            waste_percentages.append(structures_data.get('waste_percentage', 10))
+
+            for structure in parse_structures_data(structures_data):
+                structure_index = len(structures)
+                structures.append(structure)
+                structure_project.append(project_index)
+                lengths.append(structure.length_m)
+                widths.append(structure.width_m)
+                heights.append(structure.height_m)
+
+                for opening in structure.openings:
+                    openings.append(opening)
+                    opening_structure.append(structure_index)
+                    opening_widths.append(opening.width_m)
+                    opening_heights.append(opening.height_m)
+                    quantities.append(opening.quantity)
+
+        self.structures = structures
+        self.openings = openings
+        self.project_block_area = np.array(project_block_area, dtype=float)
+        self.waste_percentage = np.array(waste_percentages, dtype=float)
+
+        self.structure_project = np.array(structure_project, dtype=np.intp)
+        self.length_m = np.array(lengths, dtype=float)
+        self.width_m = np.array(widths, dtype=float)
+        self.height_m = np.array(heights, dtype=float)
+
+        self.opening_structure = np.array(opening_structure, dtype=np.intp)
+        self.opening_width_m = np.array(opening_widths, dtype=float)
+        self.opening_height_m = np.array(opening_heights, dtype=float)
+        self.quantity = np.array(quantities, dtype=float)
+
+    def calculate(self, include_breakdown=True):
+        """Return one BlockCalculator-style result dict per project"""
+        project_count = len(self.projects_data)
+
+        # Same operation order as the scalar code
+        wall_area = (2 * self.length_m * self.height_m) + (2 * self.width_m * self.height_m)
+
+        opening_area = self.opening_width_m * self.opening_height_m * self.quantity
+        openings_area = np.zeros(len(self.structures))
+        # ufunc.at is unbuffered and applied in index order, i.e. sequential sums
+        np.add.at(openings_area, self.opening_structure, opening_area)
+
+        net_area = wall_area - openings_area
+        block_area = self.project_block_area[self.structure_project]
+        has_blocks = net_area > 0
+        blocks = np.where(has_blocks, net_area / block_area, 0.0)
+
+        raw_blocks = np.zeros(project_count)
+        total_net_area = np.zeros(project_count)
+        np.add.at(raw_blocks, self.structure_project, blocks)
+        np.add.at(total_net_area, self.structure_project, net_area)
+
+        total_blocks = np.ceil(raw_blocks * (1 + self.waste_percentage / 100))
+        waste_blocks = total_blocks - raw_blocks
+        cement_bags = np.ceil(total_blocks / 75)
+        sand_trucks = np.ceil(total_blocks / 2000)
+
+        structure_counts = np.bincount(self.structure_project, minlength=project_count)
+
+        breakdowns = None
+        if include_breakdown:
+            breakdowns = self._build_breakdowns(
+                wall_area.tolist(), openings_area.tolist(), net_area.tolist(),
+                blocks.tolist(), has_blocks.tolist(), opening_area.tolist()
+            )
+
+        calculation_time = datetime.utcnow().isoformat()
+        raw_blocks = raw_blocks.tolist()
+        total_net_area = total_net_area.tolist()
+        total_blocks = total_blocks.tolist()
+        waste_blocks = waste_blocks.tolist()
+        cement_bags = cement_bags.tolist()
+        sand_trucks = sand_trucks.tolist()
+        structure_counts = structure_counts.tolist()
+
+        results = []
+        for index, structures_data in enumerate(self.projects_data):
+            # The scalar calculator keeps integer zeros when nothing was summed
+            no_blocks = raw_blocks[index] == 0
+            result = {
+                'total_blocks': int(total_blocks[index]),
+                'total_area': total_net_area[index] if structure_counts[index] else 0,
+                'waste_blocks': 0 if no_blocks else waste_blocks[index],
+                'waste_percentage': structures_data.get('waste_percentage', 10),
+                'block_type': self.block_types[index],
+                'cement_bags': int(cement_bags[index]),
+                'sand_trucks': int(sand_trucks[index]),
+                'calculation_time': calculation_time
+            }
+            if breakdowns is not None:
+                result['structure_breakdown'] = breakdowns[index]
+            results.append(result)
+
+        return results
+
+    def _build_breakdowns(self, wall_area, openings_area, net_area, blocks, has_blocks, opening_area):
+        """Rebuild the per-structure breakdown lists of BlockCalculator.calculate()"""
+        opening_structure = self.opening_structure.tolist()
+        structure_project = self.structure_project.tolist()
+
+        openings_breakdowns = [[] for _ in self.structures]
+        for opening_index, opening in enumerate(self.openings):
+            openings_breakdowns[opening_structure[opening_index]].append({
+                'type': opening.type,
+                'width': opening.width,
+                'height': opening.height,
+                'unit': opening.unit,
+                'quantity': opening.quantity,
+                'area': opening_area[opening_index]
+            })
+
+        breakdowns = [[] for _ in self.projects_data]
+        for index, structure in enumerate(self.structures):
+            openings_breakdown = openings_breakdowns[index]
+            structure_area = openings_area[index] if openings_breakdown else 0
+
+            if has_blocks[index]:
+                structure_blocks = blocks[index]
+                structure_details = {
+                    'dimensions': {
+                        'length': structure.length,
+                        'width': structure.width,
+                        'height': structure.height,
+                        'unit': structure.unit
+                    },
+                    'wall_area': wall_area[index],
+                    'openings_breakdown': openings_breakdown
+                }
+            else:
+                structure_blocks = 0
+                structure_details = openings_breakdown
+
+            breakdowns[structure_project[index]].append({
+                'name': structure.name,
+                'type': structure.type,
+                'total_area': wall_area[index],
+                'openings_area': structure_area,
+                'net_area': net_area[index],
+                'blocks': structure_blocks,
+                'details': structure_details
+            })
+
+        return breakdowns
+
+
+def calculate_many(projects_data, block_type='9_inch_hollow', include_breakdown=True, use_cache=True):
+    """Calculate a list of structures_data dicts in one vectorised pass.
+
+    With use_cache the shared calculation cache is consulted first and only
+    the misses are calculated; their full results (breakdown included) are
+    stored so later single-project views reuse them.
+    """
+    projects_data = list(projects_data)
+    if not use_cache:
+        return BatchBlockCalculator(projects_data, block_type=block_type).calculate(include_breakdown=include_breakdown)
+
+    if isinstance(block_type, str):
+        block_types = [block_type] * len(projects_data)
+    else:
+        block_types = list(block_type)
+
+    keys = [calculation_key(data, bt) for data, bt in zip(projects_data, block_types)]
+    results = [calculation_cache.get(key) for key in keys]
+    missing = [index for index, result in enumerate(results) if result is None]
+
+    if missing:
+        started = time.perf_counter()
+        calculated = BatchBlockCalculator(
+            [projects_data[index] for index in missing],
+            block_type=[block_types[index] for index in missing]
+        ).calculate()
+        calculation_cache.stats.record_compute(calculation_cache.namespace, time.perf_counter() - started,
+                                               count=len(missing))
+        for index, result in zip(missing, calculated):
+            calculation_cache.set(keys[index], result)
+            results[index] = result
+
+    return results
+
+
+def recalculate_chunk(chunk):
+    """Calculate a chunk of (project_id, structures_data, block_type) rows.
+
+    Runs in a worker process started with 'spawn', so it only touches plain
+    data and this module imports nothing but calculation code. Returns
+    (mappings, structure_rows, failed_ids) where mappings are ready for a
+    bulk UPDATE of projects and structure_rows for a bulk INSERT of
+    ProjectStructure rows.
+    """
+    try:
+        results = BatchBlockCalculator(
+            [structures_data for _, structures_data, _ in chunk],
+            block_type=[block_type for _, _, block_type in chunk]
+        ).calculate()
+        calculated = list(zip(chunk, results))
+    except Exception:
+        # One bad project fails the whole batch - retry them one by one
+        calculated = []
+        for row in chunk:
+            try:
+                result = BatchBlockCalculator([row[1]], block_type=row[2]).calculate()[0]
+            except Exception:
+                result = None
+            calculated.append((row, result))
+
+    mappings = []
+    structure_rows = []
+    failed_ids = []
+    for (project_id, structures_data, block_type), result in calculated:
+        if result is None:
+            failed_ids.append(project_id)
+            continue
+        for position, spec in enumerate(parse_structures_data(structures_data)):
+            structure_rows.append(dict(spec.to_metric_dict(), project_id=project_id, position=position))
+        mappings.append({
+            'id': project_id,
+            'total_blocks': result['total_blocks'],
+            'total_area': result['total_area'],
+            'calculation_data': result,
+            'calculation_hash': calculation_key(structures_data, block_type),
+            'calculation_version': STANDARDS_VERSION
+        })
+
+    return mappings, structure_rows, failed_ids
@@ -1,81 +1,765 @@
+import os
+import sys
+import json
+import math
 import time
+import pickle
+import random
+import hashlib
+import sqlite3
 import functools
-from flask import current_app
+import threading
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy.engine import Row, RowMapping
 from app import db
 
-class CacheManager:
+
+def estimate_size(value, _seen=None):
+    """Approximate memory footprint of a value in bytes"""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in value)
+    return size
+
+def make_cacheable(value):
+    """Detach a value from the database session so it can be cached.
+    
+    SQLAlchemy Rows become tuples and RowMappings dicts, recursively through
+    lists, tuples, sets and dicts. ORM instances are bound to the session that
+    loaded them and are refused with a TypeError.
+    """
+    if isinstance(value, Row):
+        return tuple(make_cacheable(item) for item in value)
+    if isinstance(value, RowMapping):
+        return {key: make_cacheable(item) for key, item in value.items()}
+    if isinstance(value, dict):
+        return {key: make_cacheable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return type(value)(make_cacheable(item) for item in value)
+    if hasattr(value, '_sa_instance_state'):
+        raise TypeError(f"{type(value).__name__} instances are bound to a session and cannot be cached")
+    return value
+
+def key_namespace(key):
+    """Namespace of a make_cache_key() key, e.g. 'cache:get_site_statistics'"""
+    return key.rsplit(':', 1)[0] if ':' in key else key
+
+class CacheStats:
+    """Per-namespace cache counters for this process.
+    
+    Counters only ever grow (reset() aside), so rates can be derived by
+    scraping them periodically.
+    """
+    COUNTERS = ('hits', 'stale_hits', 'misses', 'sets', 'evictions', 'expirations', 'invalidations')
+    
     def __init__(self):
-        self.cache = {}
-        self.default_timeout = 300  # 5 minutes
+        self.namespaces = {}  # namespace -> {counter: value}
+        self.lock = threading.Lock()
+    
+    def _counters(self, namespace):
+        counters = self.namespaces.get(namespace)
+        if counters is None:
+            counters = dict.fromkeys(self.COUNTERS, 0)
+            counters.update(computes=0, compute_seconds=0.0)
+            self.namespaces[namespace] = counters
+        return counters
+    
+    def incr(self, namespace, counter, amount=1):
+        with self.lock:
+            self._counters(namespace)[counter] += amount
+    
+    def record_compute(self, namespace, seconds, count=1):
+        """Record count recomputations of values and how long they took in total"""
+        with self.lock:
+            counters = self._counters(namespace)
+            counters['computes'] += count
+            counters['compute_seconds'] += seconds
+    
+    def snapshot(self):
+        with self.lock:
+            return {namespace: dict(counters) for namespace, counters in self.namespaces.items()}
+    
+    def reset(self):
+        with self.lock:
+            self.namespaces.clear()
+
+class CacheBackend:
+    """Storage interface behind CacheManager.
+    
+    get() returns None for missing or expired keys; set() takes the timeout
+    in seconds and the tags the entry depends on. Values have already been
+    passed through make_cacheable().
+    """
+    stats = None  # CacheStats of the owning CacheManager
+    
+    def _record(self, key, counter):
+        if self.stats is not None:
+            self.stats.incr(key_namespace(key), counter)
     
     def get(self, key):
-        """Get value from cache"""
-        if key in self.cache:
-            data, expiry = self.cache[key]
-            if time.time() < expiry:
-                return data
-            else:
-                del self.cache[key]
+        raise NotImplementedError
+    
+    def set(self, key, value, timeout, tags=()):
+        raise NotImplementedError
+    
+    def invalidate_tags(self, tags):
+        """Delete every entry carrying any of the tags; returns how many were deleted"""
+        raise NotImplementedError
+    
+    def delete(self, key):
+        raise NotImplementedError
+    
+    def clear(self):
+        raise NotImplementedError
+    
+    def keys(self):
+        """All keys currently stored (expired ones may still be listed)"""
+        raise NotImplementedError
+    
+    def sweep(self):
+        """Remove every expired entry now; returns how many were removed"""
+        raise NotImplementedError
+    
+    def usage(self):
+        """{namespace: (entries, bytes)} of what is stored now"""
+        raise NotImplementedError
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process backend, bounded by entry count and bytes.
+    
+    Entries are kept in LRU order and the least recently used ones are
+    evicted once either limit is exceeded. Expired entries are dropped when
+    read and by a sweep that runs from set() at most every sweep_interval
+    seconds, so keys that are never read again do not pile up. A tag index
+    maps each tag to the keys carrying it.
+    """
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024, sweep_interval=60):
+        self.cache = OrderedDict()  # key -> (value, expiry, size, tags)
+        self.tags = {}  # tag -> set of keys
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.current_bytes = 0
+        self.next_sweep = time.time() + sweep_interval
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        """Get value from cache and mark it most recently used"""
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            if time.time() < entry[1]:
+                self.cache.move_to_end(key)
+                return entry[0]
+            self._remove(key)
+            self._record(key, 'expirations')
         return None
     
-    def set(self, key, value, timeout=None):
-        """Set value in cache"""
+    def set(self, key, value, timeout, tags=()):
+        """Set value in cache, evicting expired and least recently used entries"""
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+        
+        now = time.time()
+        tags = tuple(tags)
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
+            self.cache[key] = (value, now + timeout, size, tags)
+            self.current_bytes += size
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            
+            if now >= self.next_sweep:
+                self._sweep(now)
+            self._evict()
+    
+    def invalidate_tags(self, tags):
+        with self.lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self.tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+                self._record(key, 'invalidations')
+            return len(keys)
+    
+    def delete(self, key):
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
+    
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.tags.clear()
+            self.current_bytes = 0
+    
+    def keys(self):
+        with self.lock:
+            return list(self.cache.keys())
+    
+    def sweep(self):
+        with self.lock:
+            return self._sweep(time.time())
+    
+    def usage(self):
+        usage = {}
+        with self.lock:
+            for key, entry in self.cache.items():
+                entries, total_bytes = usage.get(key_namespace(key), (0, 0))
+                usage[key_namespace(key)] = (entries + 1, total_bytes + entry[2])
+        return usage
+    
+    def _remove(self, key):
+        """Drop an entry and its tag index references (lock held)"""
+        _, _, size, tags = self.cache.pop(key)
+        self.current_bytes -= size
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+    
+    def _sweep(self, now):
+        expired = [key for key, entry in self.cache.items() if entry[1] <= now]
+        for key in expired:
+            self._remove(key)
+            self._record(key, 'expirations')
+        self.next_sweep = now + self.sweep_interval
+        return len(expired)
+    
+    def _evict(self):
+        while self.cache and (len(self.cache) > self.max_entries or self.current_bytes > self.max_bytes):
+            key = next(iter(self.cache))
+            self._remove(key)
+            self._record(key, 'evictions')
+
+class SQLiteCacheBackend(CacheBackend):
+    """Backend shared by every worker process through one SQLite file.
+    
+    Values are pickled after make_cacheable(), so nothing bound to a
+    database session is stored. The same entry and byte limits apply; when
+    over them the entries closest to expiry are evicted first (tracking LRU
+    order would turn every read into a write on the shared file).
+    """
+    def __init__(self, path, max_entries=1000, max_bytes=32 * 1024 * 1024, sweep_interval=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.next_sweep = time.time() + sweep_interval
+        self.local = threading.local()  # one connection per thread, opened on first use
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+    
+    def _create_tables(self, connection):
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'expires_at REAL NOT NULL, size INTEGER NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_entries_expires_at ON cache_entries (expires_at)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_tags ('
+                'tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_tags_key ON cache_tags (key)')
+    
+    def _connect(self):
+        """This thread's connection. A forked worker inherits the thread-local
+        connection of the thread that forked, which must not be used in the
+        child, so connections are kept per process id as well."""
+        pid = os.getpid()
+        if getattr(self.local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._create_tables(connection)
+            self.local.connection = connection
+            self.local.pid = pid
+        return self.local.connection
+    
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            # Written by an incompatible version of the code - treat as a miss
+            self.delete(key)
+            return None
+    
+    def set(self, key, value, timeout, tags=()):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(key) + len(blob)
+        if size > self.max_bytes:
+            return
+        
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires_at, size) VALUES (?, ?, ?, ?)',
+                (key, blob, now + timeout, size)
+            )
+            connection.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            connection.executemany(
+                'INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)',
+                [(tag, key) for tag in tags]
+            )
+            if now >= self.next_sweep:
+                self._sweep(connection, now)
+            self._evict(connection)
+    
+    def invalidate_tags(self, tags):
+        tags = list(tags)
+        if not tags:
+            return 0
+        with self._connect() as connection:
+            placeholders = ', '.join('?' * len(tags))
+            keys = [row[0] for row in connection.execute(
+                f'SELECT DISTINCT key FROM cache_tags WHERE tag IN ({placeholders})', tags
+            )]
+            self._remove_keys(connection, keys)
+            for key in keys:
+                self._record(key, 'invalidations')
+            return len(keys)
+    
+    def delete(self, key):
+        with self._connect() as connection:
+            self._remove_keys(connection, [key])
+    
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM cache_entries')
+            connection.execute('DELETE FROM cache_tags')
+    
+    def keys(self):
+        return [row[0] for row in self._connect().execute('SELECT key FROM cache_entries')]
+    
+    def sweep(self):
+        with self._connect() as connection:
+            return self._sweep(connection, time.time())
+    
+    def usage(self):
+        usage = {}
+        for key, size in self._connect().execute('SELECT key, size FROM cache_entries'):
+            entries, total_bytes = usage.get(key_namespace(key), (0, 0))
+            usage[key_namespace(key)] = (entries + 1, total_bytes + size)
+        return usage
+    
+    def _remove_keys(self, connection, keys):
+        connection.executemany('DELETE FROM cache_entries WHERE key = ?', [(key,) for key in keys])
+        connection.executemany('DELETE FROM cache_tags WHERE key = ?', [(key,) for key in keys])
+    
+    def _sweep(self, connection, now):
+        self.next_sweep = now + self.sweep_interval
+        expired = [row[0] for row in connection.execute(
+            'SELECT key FROM cache_entries WHERE expires_at <= ?', (now,)
+        )]
+        self._remove_keys(connection, expired)
+        for key in expired:
+            self._record(key, 'expirations')
+        return len(expired)
+    
+    def _evict(self, connection):
+        count, total_bytes = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries'
+        ).fetchone()
+        while count > self.max_entries or total_bytes > self.max_bytes:
+            key, size = connection.execute(
+                'SELECT key, size FROM cache_entries ORDER BY expires_at LIMIT 1'
+            ).fetchone()
+            self._remove_keys(connection, [key])
+            self._record(key, 'evictions')
+            count -= 1
+            total_bytes -= size
+
+def create_cache_backend(config):
+    """Build the @cached backend selected by CACHE_BACKEND"""
+    name = config.get('CACHE_BACKEND', 'memory')
+    limits = {
+        'max_entries': config.get('CACHE_MAX_ENTRIES', 1000),
+        'max_bytes': config.get('CACHE_MAX_BYTES', 32 * 1024 * 1024),
+        'sweep_interval': config.get('CACHE_SWEEP_INTERVAL', 60)
+    }
+    
+    if name == 'memory':
+        return MemoryCacheBackend(**limits)
+    if name == 'sqlite':
+        return SQLiteCacheBackend(config['CACHE_SQLITE_PATH'], **limits)
+    raise ValueError(f"Unknown CACHE_BACKEND: {name}")
+
+class CacheManager:
+    """Front end for @cached results; storage is delegated to a CacheBackend.
+    
+    The default in-process backend is per worker. Configure the SQLite backend
+    to share results between all worker processes on a host.
+    """
+    def __init__(self, backend=None, default_timeout=300):
+        self.stats = CacheStats()
+        self.backend = backend or MemoryCacheBackend()
+        self.backend.stats = self.stats
+        self.default_timeout = default_timeout  # 5 minutes
+    
+    def configure(self, backend=None, default_timeout=None):
+        """Swap the backend and/or change the default timeout"""
+        if backend is not None:
+            self.backend = backend
+            self.backend.stats = self.stats
+        if default_timeout is not None:
+            self.default_timeout = default_timeout
+    
+    def get(self, key):
+        """Get value from cache"""
+        value = self.backend.get(key)
+        self.stats.incr(key_namespace(key), 'misses' if value is None else 'hits')
+        return value
+    
+    def set(self, key, value, timeout=None, tags=()):
+        """Set value in cache; returns False if the value cannot be cached"""
         if timeout is None:
             timeout = self.default_timeout
         
-        expiry = time.time() + timeout
-        self.cache[key] = (value, expiry)
+        try:
+            self.backend.set(key, make_cacheable(value), timeout, tags)
+        except (TypeError, pickle.PicklingError) as e:
+            print(f"DEBUG: Not caching {key}: {e}")
+            return False
+        self.stats.incr(key_namespace(key), 'sets')
+        return True
+    
+    def invalidate_tags(self, *tags):
+        """Delete exactly the entries that depend on any of the tags"""
+        return self.backend.invalidate_tags(tags)
     
     def delete(self, key):
         """Delete value from cache"""
-        if key in self.cache:
-            del self.cache[key]
+        self.backend.delete(key)
     
     def clear(self):
         """Clear all cache"""
-        self.cache.clear()
+        self.backend.clear()
+    
+    def keys(self):
+        return self.backend.keys()
+    
+    def sweep(self):
+        """Remove every expired entry now; returns how many were removed"""
+        return self.backend.sweep()
+    
+    def usage(self):
+        return self.backend.usage()
 
-# Global cache instance
+class CalculationCache:
+    """LRU cache for calculator results, bounded by entry count and bytes.
+    
+    Keys are content hashes (see BlockCalculator.cache_key), so entries never
+    go stale and need no timeout: changed inputs simply hash to a new key.
+    """
+    def __init__(self, max_entries=2000, max_bytes=64 * 1024 * 1024, namespace='calculation'):
+        self.namespace = namespace  # stats namespace of every entry
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+    
+    def configure(self, max_entries=None, max_bytes=None):
+        """Change the limits, evicting if the cache is now over them"""
+        with self.lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+    
+    def get(self, key):
+        """Get value from cache and mark it most recently used"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats.incr(self.namespace, 'misses')
+                return None
+            self.entries.move_to_end(key)
+            self.stats.incr(self.namespace, 'hits')
+            return entry[0]
+    
+    def set(self, key, value):
+        """Set value in cache, evicting least recently used entries"""
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.current_bytes += size
+            self.stats.incr(self.namespace, 'sets')
+            self._evict()
+    
+    def clear(self):
+        """Clear all cached results"""
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+    
+    def usage(self):
+        with self.lock:
+            return {self.namespace: (len(self.entries), self.current_bytes)}
+    
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.current_bytes -= size
+            self.stats.incr(self.namespace, 'evictions')
+
+# Global cache instances
 cache_manager = CacheManager()
+calculation_cache = CalculationCache()
+# Per-structure results, keyed by block type and structure fingerprint
+structure_result_cache = CalculationCache(max_entries=50000, max_bytes=16 * 1024 * 1024,
+                                          namespace='structure_results')
+
+def make_cache_key(namespace, args=(), kwargs=None):
+    """Stable, fixed-length key: '<namespace>:<hash of the arguments>'"""
+    payload = json.dumps([args, kwargs or {}], sort_keys=True, separators=(',', ':'), default=repr)
+    return f"{namespace}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]}"
+
+class _Flight:
+    """One in-progress computation of a cache key that other callers can wait on"""
+    __slots__ = ('done', 'result', 'error')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+# cache key -> _Flight, for the keys being computed in this process
+_flights = {}
+_flights_lock = threading.Lock()
+
+# Seconds a caller waits on another caller's computation before computing itself
+FLIGHT_WAIT_TIMEOUT = 30
+
+def _claim_flight(key):
+    """Return (flight, True) if the caller should compute key, else the running (flight, False)"""
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+def _run_flight(key, flight, load, app=None):
+    """Compute a claimed key and wake everyone waiting on it"""
+    try:
+        if app is not None:
+            with app.app_context():
+                flight.result = load()
+        else:
+            flight.result = load()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        if app is None:
+            raise
+        print(f"DEBUG: Background refresh of {key} failed: {e}")
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
 
-def cached(timeout=300, key_prefix='cache'):
-    """Decorator for caching function results"""
+def _wait_flight(flight, load, timeout=None):
+    """Result of another caller's computation, or load() if it takes longer than
+    timeout (default FLIGHT_WAIT_TIMEOUT) seconds"""
+    if not flight.done.wait(FLIGHT_WAIT_TIMEOUT if timeout is None else timeout):
+        return load()
+    if flight.error is not None:
+        raise flight.error
+    return flight.result
+
+def _refresh_due(fresh_until, delta, early_expiry, now):
+    """Probabilistic early expiry: recompute a little before fresh_until.
+    
+    The chance grows as expiry approaches and with the time the value takes
+    to compute (delta), so one caller usually refreshes before the entry
+    expires for everyone at once. early_expiry=0 disables it.
+    """
+    if now >= fresh_until:
+        return True
+    if early_expiry <= 0:
+        return False
+    return now - delta * early_expiry * math.log(1.0 - random.random()) >= fresh_until
+
+def cached(timeout=300, key_prefix='cache', tags=(), stale_ttl=0, early_expiry=1.0):
+    """Decorator for caching function results
+    
+    tags are the invalidation tags of the result (e.g. 'prices',
+    'projects'): a list, or a function called with the same arguments
+    that returns one. invalidate_tags() then drops exactly the dependent
+    entries.
+    
+    Concurrent misses of a key are single-flight: one caller computes it and
+    the others in this process wait for its result instead of recomputing.
+    Entries may be refreshed slightly before they expire (early_expiry, see
+    _refresh_due). With stale_ttl > 0 an expired value is still served for
+    up to stale_ttl seconds while one background thread recomputes it, so
+    no caller blocks on the refresh.
+    """
     def decorator(f):
+        namespace = f"{key_prefix}:{f.__name__}"
+        
         @functools.wraps(f)
         def decorated_function(*args, **kwargs):
             # Generate cache key
-            cache_key = f"{key_prefix}:{f.__name__}:{str(args)}:{str(kwargs)}"
+            cache_key = make_cache_key(namespace, args, kwargs)
             
-            # Try to get from cache
-            cached_result = cache_manager.get(cache_key)
-            if cached_result is not None:
-                return cached_result
+            def load():
+                # Execute function and cache result, returning the detached copy
+                # so the first call and cache hits give the same types
+                started = time.time()
+                result = f(*args, **kwargs)
+                try:
+                    result = make_cacheable(result)
+                except TypeError:
+                    return result
+                finished = time.time()
+                cache_manager.stats.record_compute(namespace, finished - started)
+                entry_tags = tags(*args, **kwargs) if callable(tags) else tags
+                cache_manager.set(cache_key, (result, finished + timeout, finished - started),
+                                  timeout + stale_ttl, entry_tags)
+                return result
             
-            # Execute function and cache result
-            result = f(*args, **kwargs)
-            cache_manager.set(cache_key, result, timeout)
+            # Try to get from cache; entries are (value, fresh_until, compute seconds)
+            entry = cache_manager.get(cache_key)
+            if entry is not None:
+                value, fresh_until, delta = entry
+                now = time.time()
+                if not _refresh_due(fresh_until, delta, early_expiry, now):
+                    return value
+                
+                # Refresh due: one caller refreshes, everyone else keeps the current value
+                flight, leader = _claim_flight(cache_key)
+                if leader and not (stale_ttl and has_app_context()):
+                    if now >= fresh_until:
+                        return _run_flight(cache_key, flight, load)
+                    # Early refresh of a still fresh entry: a failure keeps the current value
+                    try:
+                        return _run_flight(cache_key, flight, load)
+                    except Exception as e:
+                        print(f"DEBUG: Early refresh of {cache_key} failed: {e}")
+                        return value
+                if leader:
+                    app = current_app._get_current_object()
+                    threading.Thread(target=_run_flight, args=(cache_key, flight, load, app),
+                                     daemon=True).start()
+                if now >= fresh_until:
+                    cache_manager.stats.incr(namespace, 'stale_hits')
+                return value
             
-            return result
+            flight, leader = _claim_flight(cache_key)
+            if leader:
+                return _run_flight(cache_key, flight, load)
+            return _wait_flight(flight, load)
         return decorated_function
     return decorator
 
-def cache_clear(pattern='*'):
-    """Clear cache by pattern"""
-    if pattern == '*':
+def invalidate_tags(*tags):
+    """Drop every cached result tagged with any of the tags"""
+    return cache_manager.invalidate_tags(*tags)
+
+def cache_metrics():
+    """Counters, size and average recompute time of every cache namespace.
+    
+    Counters are for this worker process only. Entries and bytes are what the
+    backend holds now, which is shared by all workers with the SQLite backend.
+    """
+    metrics = {}
+    for cache in (cache_manager, calculation_cache, structure_result_cache):
+        stats = cache.stats.snapshot()
+        usage = cache.usage()
+        for namespace in sorted(set(stats) | set(usage)):
+            counters = stats.get(namespace) or dict.fromkeys(CacheStats.COUNTERS, 0)
+            computes = counters.get('computes', 0)
+            compute_seconds = counters.get('compute_seconds', 0.0)
+            lookups = counters['hits'] + counters['misses']
+            entries, total_bytes = usage.get(namespace, (0, 0))
+            metrics[namespace] = {
+                **{counter: counters[counter] for counter in CacheStats.COUNTERS},
+                'computes': computes,
+                'compute_seconds': round(compute_seconds, 6),
+                'avg_compute_ms': round(compute_seconds / computes * 1000, 3) if computes else None,
+                'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else None,
+                'entries': entries,
+                'bytes': total_bytes
+            }
+    return metrics
+
+def _prometheus_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def cache_metrics_prometheus(metrics=None):
+    """cache_metrics() in the Prometheus text exposition format"""
+    if metrics is None:
+        metrics = cache_metrics()
+    
+    # (name, type, help, [(sample suffix, field)])
+    families = [(f'buildify_cache_{counter}_total', 'counter', f'Cache {counter.replace("_", " ")}', [('', counter)])
+                for counter in CacheStats.COUNTERS]
+    families += [
+        ('buildify_cache_compute_seconds', 'summary', 'Time spent recomputing cached values',
+         [('_sum', 'compute_seconds'), ('_count', 'computes')]),
+        ('buildify_cache_entries', 'gauge', 'Entries currently cached', [('', 'entries')]),
+        ('buildify_cache_bytes', 'gauge', 'Approximate bytes currently cached', [('', 'bytes')]),
+    ]
+    
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for namespace, values in metrics.items():
+            for suffix, field in samples:
+                lines.append(f'{name}{suffix}{{namespace="{_prometheus_label(namespace)}"}} {values[field]}')
+    return '\n'.join(lines) + '\n'
+
+def cache_clear(namespace=None):
+    """Clear the whole cache, or the entries of one namespace such as
+    'cache:get_site_statistics' (scans every key; prefer invalidate_tags)"""
+    if namespace is None:
         cache_manager.clear()
     else:
-        keys_to_delete = [key for key in cache_manager.cache.keys() if pattern in key]
+        prefix = f"{namespace}:"
+        keys_to_delete = [key for key in cache_manager.keys() if key.startswith(prefix)]
         for key in keys_to_delete:
             cache_manager.delete(key)
 
 # Cached database queries
-@cached(timeout=300)
+@cached(timeout=300, tags=['prices'], stale_ttl=300)
 def get_cached_block_prices():
     """Get block prices with caching"""
     from app.utils.price_fetcher import get_current_prices
     return get_current_prices()
 
-@cached(timeout=600)
+@cached(timeout=600, tags=['projects'])
 def get_popular_house_types(limit=10):
     """Get popular house types with caching"""
     from sqlalchemy import func
@@ -88,7 +772,7 @@ def get_popular_house_types(limit=10):
      .order_by(func.count(Project.id).desc())\
      .limit(limit).all()
 
-@cached(timeout=3600)
+@cached(timeout=3600, tags=['projects', 'users'], stale_ttl=600)
 def get_site_statistics():
     """Get site statistics with caching"""
     from app.models import User, Project
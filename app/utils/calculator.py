@@ -1,8 +1,42 @@
+import copy
 import math
+import json
+import time
+import hashlib
 from app.utils.structure_templates import NIGERIAN_BLOCK_STANDARDS, MEASUREMENT_UNITS
+from app.utils.structure_specs import OPENING_TYPES, parse_structures_data, to_meters
+from app.utils.cache import calculation_cache, structure_result_cache
 
 from datetime import datetime  # Add this import
 
+# Bump when the calculation rules change so cached results are not reused
+CALCULATOR_VERSION = '1'
+
+
+def canonical_hash(value):
+    """Stable SHA-256 of a JSON-compatible value (key order independent)"""
+    payload = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Changes whenever the block standards, units or calculator rules change
+STANDARDS_VERSION = canonical_hash({
+    'calculator': CALCULATOR_VERSION,
+    'block_standards': NIGERIAN_BLOCK_STANDARDS,
+    'units': MEASUREMENT_UNITS,
+    'opening_types': OPENING_TYPES
+})[:12]
+
+
+def calculation_key(structures_data, block_type='9_inch_hollow'):
+    """Content hash of everything a calculation result depends on"""
+    return canonical_hash({
+        'structures': structures_data.get('structures', []),
+        'block_type': block_type,
+        'waste_percentage': structures_data.get('waste_percentage', 10),
+        'standards_version': STANDARDS_VERSION
+    })
+
 
 class BlockCalculator:
     def __init__(self, structures_data, block_type='9_inch_hollow'):
@@ -10,7 +44,37 @@ class BlockCalculator:
         self.block_type = block_type
         self.block_standard = NIGERIAN_BLOCK_STANDARDS[block_type]
         self.waste_percentage = structures_data.get('waste_percentage', 10)
+        self._specs = None
+    
+    @property
+    def specs(self):
+        """structures_data parsed into StructureSpecs (raises StructureValidationError)"""
+        if self._specs is None:
+            self._specs = parse_structures_data(self.structures_data)
+        return self._specs
+    
+    def validate(self):
+        """Parse structures_data now; raises StructureValidationError if invalid"""
+        self.specs
         
+    def cache_key(self):
+        """Content hash of everything the calculation result depends on"""
+        return calculation_key(self.structures_data, self.block_type)
+    
+    def calculate_cached(self):
+        """Return calculate() through the shared calculation cache.
+        
+        The result dict is shared between callers and must not be modified.
+        """
+        key = self.cache_key()
+        result = calculation_cache.get(key)
+        if result is None:
+            started = time.perf_counter()
+            result = self.calculate()
+            calculation_cache.stats.record_compute(calculation_cache.namespace, time.perf_counter() - started)
+            calculation_cache.set(key, result)
+        return result
+    
     def calculate(self):
         """Main calculation method - UPDATED without price"""
         print("DEBUG: Starting calculation with structures:", self.structures_data)
@@ -20,29 +84,39 @@ class BlockCalculator:
         total_net_area = 0
         structure_breakdown = []
         
-        structures = self.structures_data.get('structures', [])
-        print(f"DEBUG: Found {len(structures)} structures")
+        print(f"DEBUG: Found {len(self.specs)} structures")
         
-        for structure in structures:
-            (structure_blocks, structure_area, 
-            net_area, openings_area, structure_details) = self.calculate_structure_blocks(structure)
+        for (structure_blocks, structure_area, 
+             net_area, openings_area, breakdown_entry) in self.iter_structures():
             
+            # Totals are re-accumulated in order (rather than patched by the
+            # delta) so they stay identical to a full recalculation
             total_blocks += structure_blocks
             total_wall_area += structure_area
             total_net_area += net_area
             
-            structure_breakdown.append({
-                'name': structure.get('name', 'Unnamed Structure'),
-                'type': structure.get('type', 'unknown'),
-                'total_area': structure_area,
-                'openings_area': openings_area,
-                'net_area': net_area,
-                'blocks': structure_blocks,
-                'details': structure_details
-            })
+            structure_breakdown.append(breakdown_entry)
         
         print(f"DEBUG: Total blocks before waste: {total_blocks}")
         
+        result = self.summarize(total_blocks, total_net_area, structure_breakdown)
+        
+        print("DEBUG: Final result:", result)
+        return result
+    
+    def iter_structures(self, memoize=True):
+        """Yield the result of each structure in order, one at a time.
+        
+        Each item is (blocks, wall_area, net_area, openings_area, breakdown_entry).
+        Used by calculate() and by the streaming endpoint, which never holds
+        the whole breakdown in memory. memoize=False skips the shared
+        structure_result_cache, so a one-off preview does not fill it.
+        """
+        for spec in self.specs:
+            yield self.calculate_structure_cached(spec) if memoize else self.build_structure_result(spec)
+    
+    def summarize(self, total_blocks, total_net_area, structure_breakdown=None):
+        """Build the result totals from the summed (pre-waste) blocks and net area"""
         # Add waste percentage (Nigerian standard practice)
         total_blocks_with_waste = math.ceil(total_blocks * (1 + self.waste_percentage/100))
         waste_blocks = total_blocks_with_waste - total_blocks
@@ -60,27 +134,56 @@ class BlockCalculator:
             'waste_percentage': self.waste_percentage,
             'block_type': self.block_type,
             'cement_bags': cement_bags,
-            'sand_trucks': sand_trucks,
-            'structure_breakdown': structure_breakdown,
-            'calculation_time': datetime.utcnow().isoformat()
+            'sand_trucks': sand_trucks
         }
+        if structure_breakdown is not None:
+            result['structure_breakdown'] = structure_breakdown
+        result['calculation_time'] = datetime.utcnow().isoformat()
         
-        print("DEBUG: Final result:", result)
         return result
     
+    def calculate_structure_cached(self, structure):
+        """Return build_structure_result(), reusing it if the structure is unchanged
+        
+        Results are shared by all calculators through structure_result_cache,
+        so re-saving a project only recomputes the structures that were added
+        or changed. Every caller gets its own copy of the breakdown entry.
+        """
+        key = (self.block_type, structure.key)
+        
+        cached = structure_result_cache.get(key)
+        if cached is None:
+            cached = self.build_structure_result(structure)
+            structure_result_cache.set(key, cached)
+        
+        structure_blocks, structure_area, net_area, openings_area, breakdown_entry = cached
+        return structure_blocks, structure_area, net_area, openings_area, copy.deepcopy(breakdown_entry)
+    
+    def build_structure_result(self, structure):
+        """Calculate one structure together with its breakdown entry"""
+        (structure_blocks, structure_area, 
+        net_area, openings_area, structure_details) = self.calculate_structure_blocks(structure)
+        
+        breakdown_entry = {
+            'name': structure.name,
+            'type': structure.type,
+            'total_area': structure_area,
+            'openings_area': openings_area,
+            'net_area': net_area,
+            'blocks': structure_blocks,
+            'details': structure_details
+        }
+        
+        return structure_blocks, structure_area, net_area, openings_area, breakdown_entry
+    
      # KEEP all the helper methods but remove price-related ones
     def calculate_structure_blocks(self, structure):
-        """Calculate blocks for a single structure with detailed breakdown"""
-        # Convert dimensions to meters
-        length_m = self.convert_to_meters(structure['length'], structure['unit'])
-        width_m = self.convert_to_meters(structure['width'], structure['unit']) 
-        height_m = self.convert_to_meters(structure['height'], structure['unit'])
-        
-        # Calculate total wall area (all 4 walls)
-        wall_area = self.calculate_wall_area(length_m, width_m, height_m)
+        """Calculate blocks for a single StructureSpec with detailed breakdown"""
+        # Calculate total wall area (all 4 walls), dimensions already in meters
+        wall_area = self.calculate_wall_area(structure.length_m, structure.width_m, structure.height_m)
         
         # Calculate openings from sub-structures
-        openings_area, openings_breakdown = self.calculate_openings_area(structure.get('sub_structures', []))
+        openings_area, openings_breakdown = self.calculate_openings_area(structure.openings)
         
         # Net wall area (area that needs blocks)
         net_wall_area = wall_area - openings_area
@@ -94,10 +197,10 @@ class BlockCalculator:
         
         structure_details = {
             'dimensions': {
-                'length': structure['length'],
-                'width': structure['width'],
-                'height': structure['height'],
-                'unit': structure['unit']
+                'length': structure.length,
+                'width': structure.width,
+                'height': structure.height,
+                'unit': structure.unit
             },
             'wall_area': wall_area,
             'openings_breakdown': openings_breakdown
@@ -109,28 +212,23 @@ class BlockCalculator:
         """Calculate total area of all walls"""
         return (2 * length * height) + (2 * width * height)
     
-    def calculate_openings_area(self, sub_structures):
-        """Calculate total area of all openings with detailed breakdown"""
+    def calculate_openings_area(self, openings):
+        """Calculate total area of all OpeningSpecs with detailed breakdown"""
         total_openings_area = 0
         openings_breakdown = []
         
-        for sub_structure in sub_structures:
-            if sub_structure['type'] in ['door', 'window', 'ac_unit', 'vent']:
-                width_m = self.convert_to_meters(sub_structure['width'], sub_structure['unit'])
-                height_m = self.convert_to_meters(sub_structure['height'], sub_structure['unit'])
-                quantity = sub_structure.get('quantity', 1)
-                
-                opening_area = width_m * height_m * quantity
-                total_openings_area += opening_area
-                
-                openings_breakdown.append({
-                    'type': sub_structure['type'],
-                    'width': sub_structure['width'],
-                    'height': sub_structure['height'],
-                    'unit': sub_structure['unit'],
-                    'quantity': quantity,
-                    'area': opening_area
-                })
+        for opening in openings:
+            opening_area = opening.area
+            total_openings_area += opening_area
+            
+            openings_breakdown.append({
+                'type': opening.type,
+                'width': opening.width,
+                'height': opening.height,
+                'unit': opening.unit,
+                'quantity': opening.quantity,
+                'area': opening_area
+            })
                 
         return total_openings_area, openings_breakdown
     
@@ -199,10 +297,7 @@ class BlockCalculator:
     
     def convert_to_meters(self, value, unit):
         """Convert any unit to meters"""
-        for unit_info in MEASUREMENT_UNITS:
-            if unit_info['id'] == unit:
-                return value * unit_info['conversion_to_meters']
-        return value
+        return to_meters(value, unit)
     
     
     def calculate_cement_needed(self, total_blocks):
@@ -0,0 +1,244 @@
+"""
+Regional cost matrix.
+
+Prices a project's calculation for every region and block type at once:
+a price snapshot is turned into arrays (regions x block types x
+low/avg/high) once, and the costs of any number of calculations come out of
+a single NumPy broadcast of shape (projects, regions, block types, 3).
+Projects are priced with the snapshot they are pinned to
+(Project.price_snapshot_id), so their costs only move when they are
+repriced.
+
+A project's cost with one block type covers its blocks, the block-laying
+labour and the cement and sand the NIGERIAN_BLOCK_STANDARDS entry of that
+block type calls for per 100 blocks.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.utils.price_fetcher import get_current_prices, price_fetcher
+from app.utils.price_history import NATIONAL
+from app.utils.price_store import price_store
+from app.utils.structure_templates import NIGERIAN_BLOCK_STANDARDS
+
+LEVELS = ('low', 'avg', 'high')
+
+# Sand is priced per truck
+SAND_TRUCK_TONNES = 20
+
+# Price tables kept in memory by snapshot id
+MAX_CACHED_TABLES = 32
+
+
+def _low_avg_high(info, fallback_range=None):
+    """(low, avg, high) of a price entry; avg defaults to the middle of the range"""
+    price_range = (info or {}).get('price_range') or fallback_range
+    low, high = float(price_range[0]), float(price_range[1])
+    average = (info or {}).get('average_price')
+    return low, float(average) if average is not None else (low + high) / 2, high
+
+
+def _block_area(standard):
+    return standard['length_mm'] / 1000 * standard['height_mm'] / 1000
+
+
+class RegionalPriceTable:
+    """The prices of one snapshot as arrays, indexed by region and block type"""
+
+    def __init__(self, prices, snapshot_id=None):
+        self.snapshot_id = snapshot_id  # None for the curated prices used before any snapshot
+        curated = price_fetcher.get_curated_nigerian_prices()
+
+        def material(name):
+            # Manual overrides may only set some materials
+            info = prices.get(name)
+            return info if isinstance(info, dict) and info.get('price_range') else curated[name]
+
+        self.block_types = list(NIGERIAN_BLOCK_STANDARDS)
+        self.regions = [NATIONAL] + sorted({
+            region
+            for block_type in self.block_types
+            if isinstance(prices.get(block_type), dict)
+            for region in (prices[block_type].get('region_variation') or {})
+        })
+
+        # (regions, block types, levels); a region without its own range for a
+        # block type uses the national price
+        self.block_prices = np.empty((len(self.regions), len(self.block_types), len(LEVELS)))
+        for b, block_type in enumerate(self.block_types):
+            info = prices.get(block_type) if isinstance(prices.get(block_type), dict) else None
+            national = _low_avg_high(info, NIGERIAN_BLOCK_STANDARDS[block_type]['price_range'])
+            variation = (info or {}).get('region_variation') or {}
+            for r, region in enumerate(self.regions):
+                self.block_prices[r, b] = _low_avg_high({'price_range': variation[region]}) \
+                    if region in variation else national
+
+        self.cement_price = np.array(_low_avg_high(material('cement')))  # per bag
+        self.sand_price = np.array(_low_avg_high(material('sharp_sand'))) / SAND_TRUCK_TONNES  # per tonne
+        self.labor_price = np.array(_low_avg_high(material('labor')))  # per block laid
+
+        standards = [NIGERIAN_BLOCK_STANDARDS[block_type] for block_type in self.block_types]
+        self.block_area = np.array([_block_area(standard) for standard in standards])
+        self.cement_per_block = np.array([standard['cement_per_100_blocks'] for standard in standards]) / 100
+        self.sand_per_block = np.array([standard['sand_per_100_blocks'] for standard in standards]) / 100
+
+        self.block_index = {block_type: b for b, block_type in enumerate(self.block_types)}
+        self.region_index = {region: r for r, region in enumerate(self.regions)}
+
+    def block_prices_for(self, regions):
+        """block_prices on another region axis; regions this snapshot lacks get the national price"""
+        if regions == self.regions:
+            return self.block_prices
+        return self.block_prices[[self.region_index.get(region, 0) for region in regions]]
+
+
+_tables = OrderedDict()  # snapshot id -> RegionalPriceTable
+_tables_lock = threading.Lock()
+
+
+def regional_price_table(snapshot_id=None):
+    """RegionalPriceTable of a price snapshot, by default the current one.
+
+    Snapshots never change, so tables are built once per snapshot and a
+    pinned snapshot is served from memory without looking at the current
+    prices. An unknown snapshot id falls back to the current prices.
+    """
+    if snapshot_id is None:
+        snapshot_id = price_store.current_snapshot_id()
+    with _tables_lock:
+        table = _tables.get(snapshot_id)
+        if table is not None:
+            _tables.move_to_end(snapshot_id)
+            return table
+
+    snapshot = price_store.snapshot(snapshot_id) if snapshot_id is not None else None
+    if snapshot is None or snapshot['prices'] is None:
+        # Nothing stored yet: the curated prices, not kept
+        return RegionalPriceTable(get_current_prices())
+
+    table = RegionalPriceTable(snapshot['prices'], snapshot_id)
+    with _tables_lock:
+        _tables[snapshot_id] = table
+        while len(_tables) > MAX_CACHED_TABLES:
+            _tables.popitem(last=False)
+    return table
+
+
+class CostMatrix:
+    """Costs of a list of calculations for every region, block type and price level.
+
+    tables are the RegionalPriceTable of each calculation (default: the
+    current prices for all). Calculations pinned to different snapshots are
+    still priced in one pass on the union of their regions.
+    """
+
+    def __init__(self, calculations, tables=None):
+        calculations = list(calculations)
+        if tables is None:
+            tables = [regional_price_table()] * len(calculations)
+        tables = list(tables)
+
+        unique_tables = list({id(table): table for table in tables}.values()) or [regional_price_table()]
+        position = {id(table): index for index, table in enumerate(unique_tables)}
+        table_index = np.array([position[id(table)] for table in tables], dtype=np.intp)
+        self.snapshot_ids = [table.snapshot_id for table in tables]
+
+        first = unique_tables[0]
+        self.block_types = first.block_types
+        self.regions = [NATIONAL] + sorted({
+            region for table in unique_tables for region in table.regions if region != NATIONAL
+        })
+        # Per calculation: (projects, regions, block types, levels) and (projects, levels)
+        block_prices = np.stack([table.block_prices_for(self.regions) for table in unique_tables])[table_index]
+        labor_price = np.stack([table.labor_price for table in unique_tables])[table_index]
+        cement_price = np.stack([table.cement_price for table in unique_tables])[table_index]
+        sand_price = np.stack([table.sand_price for table in unique_tables])[table_index]
+        table = first  # block sizes and per-block materials come from the standards
+
+        total_blocks = np.array([calculation.get('total_blocks', 0) for calculation in calculations], dtype=float)
+        waste_blocks = np.array([calculation.get('waste_blocks', 0) for calculation in calculations], dtype=float)
+        waste = np.array([calculation.get('waste_percentage', 10) for calculation in calculations], dtype=float)
+        source_area = table.block_area[[table.block_index[calculation.get('block_type', '9_inch_hollow')]
+                                        for calculation in calculations]]
+
+        # The same wall area laid with each block type: (projects, block types)
+        area_ratio = source_area[:, None] / table.block_area[None, :]
+        raw_blocks = (total_blocks - waste_blocks)[:, None] * area_ratio
+        blocks = np.ceil(raw_blocks * (1 + waste / 100)[:, None])
+        # Keep the calculated count exact for the calculation's own block size
+        self.blocks = np.where(area_ratio == 1, total_blocks[:, None], blocks)
+        self.cement_bags = np.ceil(self.blocks * table.cement_per_block)
+        self.sand_tonnes = self.blocks * table.sand_per_block
+
+        # Everything but the blocks is priced the same in every region
+        materials = (self.blocks[:, :, None] * labor_price[:, None, :] +
+                     self.cement_bags[:, :, None] * cement_price[:, None, :] +
+                     self.sand_tonnes[:, :, None] * sand_price[:, None, :])
+        self.costs = self.blocks[:, None, :, None] * block_prices + materials[:, None, :, :]
+
+    def cheapest(self, costs, level='avg'):
+        """(region, block type, cost) of the lowest cost in a (regions, block types, levels) array"""
+        values = costs[:, :, LEVELS.index(level)]
+        r, b = np.unravel_index(np.argmin(values), values.shape)
+        return {'region': self.regions[r], 'block_type': self.block_types[b], 'cost': round(float(values[r, b]), 2)}
+
+    def cheapest_by_block_type(self, costs, level='avg'):
+        """Cheapest region per block type of a (regions, block types, levels) array"""
+        values = costs[:, :, LEVELS.index(level)]
+        regions = np.argmin(values, axis=0).tolist()
+        return {
+            block_type: {'region': self.regions[r], 'cost': round(float(values[r, b]), 2)}
+            for b, (block_type, r) in enumerate(zip(self.block_types, regions))
+        }
+
+    def project_summary(self, index, level='avg'):
+        """JSON-ready matrix, quantities and cheapest options of one calculation"""
+        costs = self.costs[index]
+        rounded = np.round(costs, 2).tolist()
+        return {
+            'price_snapshot_id': self.snapshot_ids[index],
+            'regions': self.regions,
+            'block_types': self.block_types,
+            'levels': list(LEVELS),
+            'costs': {
+                region: {
+                    block_type: dict(zip(LEVELS, rounded[r][b]))
+                    for b, block_type in enumerate(self.block_types)
+                }
+                for r, region in enumerate(self.regions)
+            },
+            'quantities': {
+                block_type: {
+                    'blocks': int(self.blocks[index, b]),
+                    'cement_bags': int(self.cement_bags[index, b]),
+                    'sand_tonnes': round(float(self.sand_tonnes[index, b]), 2)
+                }
+                for b, block_type in enumerate(self.block_types)
+            },
+            'cheapest': self.cheapest(costs, level),
+            'cheapest_by_block_type': self.cheapest_by_block_type(costs, level)
+        }
+
+    def portfolio_summary(self, level='avg'):
+        """Cheapest options for every calculation and for all of them together"""
+        summary = {'level': level, 'projects': [], 'cheapest': None, 'cheapest_by_block_type': {}}
+        if not len(self.costs):
+            return summary
+
+        values = self.costs[:, :, :, LEVELS.index(level)].reshape(len(self.costs), -1)
+        best = np.argmin(values, axis=1)
+        regions, block_types = np.unravel_index(best, (len(self.regions), len(self.block_types)))
+        best_costs = values[np.arange(len(values)), best]
+        summary['projects'] = [
+            {'region': self.regions[r], 'block_type': self.block_types[b], 'cost': round(float(cost), 2),
+             'price_snapshot_id': snapshot_id}
+            for r, b, cost, snapshot_id in zip(regions.tolist(), block_types.tolist(), best_costs.tolist(),
+                                               self.snapshot_ids)
+        ]
+
+        totals = self.costs.sum(axis=0)
+        summary['cheapest'] = self.cheapest(totals, level)
+        summary['cheapest_by_block_type'] = self.cheapest_by_block_type(totals, level)
+        return summary
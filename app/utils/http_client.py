@@ -0,0 +1,164 @@
+"""
+Shared HTTP client for the price sources.
+
+One pooled requests.Session per process keeps connections to the sources
+alive between refreshes. GETs are retried a bounded number of times on
+connection errors and 429/5xx answers, with exponential backoff and full
+jitter, all within the caller's timeout. Each URL's ETag / Last-Modified
+validators are remembered and sent back as If-None-Match /
+If-Modified-Since, so a source page that did not change costs a 304 and the
+previous body is reused.
+
+With a base_url every source URL is resolved against it (keeping its path
+and query), which points the fetcher at a local stub server in tests.
+"""
+import json
+import random
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class HTTPResult:
+    """Body and status of a GET; not_modified means the cached body was reused after a 304"""
+
+    def __init__(self, url, status_code, text, headers, not_modified=False, attempts=1):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+        self.not_modified = not_modified
+        self.attempts = attempts
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class PriceHTTPClient:
+    """Pooled, retrying session with conditional GETs"""
+
+    def __init__(self, base_url=None, pool_size=10, max_retries=2, backoff=0.5, backoff_max=4,
+                 user_agent='Buildify price fetcher'):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.max_retries = max_retries  # retries after the first attempt
+        self.backoff = backoff  # seconds, doubled per retry
+        self.backoff_max = backoff_max
+        self.user_agent = user_agent
+        self.validators = {}  # url -> {'etag', 'last_modified', 'text', 'headers'}
+        self.lock = threading.Lock()
+        self._session = None
+
+    def configure(self, base_url=None, pool_size=None, max_retries=None, backoff=None):
+        """Change the settings; the session is rebuilt on next use"""
+        if base_url is not None:
+            self.base_url = base_url or None
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if max_retries is not None:
+            self.max_retries = max_retries
+        if backoff is not None:
+            self.backoff = backoff
+        self.close()
+
+    @property
+    def session(self):
+        with self.lock:
+            if self._session is None:
+                session = requests.Session()
+                # Retries are done here, with jitter and within the caller's timeout
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = self.user_agent
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def resolve(self, url):
+        """url, or its path and query on base_url when one is set"""
+        if not self.base_url:
+            return url
+        parts = urlsplit(url)
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        return urljoin(self.base_url.rstrip('/') + '/', path.lstrip('/'))
+
+    def backoff_delay(self, retry):
+        """Full jitter: uniform between 0 and the capped exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** retry))
+
+    def get(self, url, timeout=5, headers=None):
+        """GET url within timeout seconds (retries included).
+
+        Raises requests.RequestException if every attempt failed or the
+        source answered with an error status.
+        """
+        url = self.resolve(url)
+        deadline = time.monotonic() + timeout
+        request_headers = dict(headers or {})
+        with self.lock:
+            cached = self.validators.get(url)
+        if cached is not None:
+            if cached['etag']:
+                request_headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                request_headers['If-Modified-Since'] = cached['last_modified']
+
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout(f'No answer from {url} within {timeout}s')
+
+            retry_after = None
+            try:
+                response = self.session.get(url, headers=request_headers, timeout=remaining)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt > self.max_retries:
+                    raise
+            else:
+                if response.status_code == 304 and cached is not None:
+                    return HTTPResult(url, 304, cached['text'], cached['headers'],
+                                      not_modified=True, attempts=attempt)
+                if response.status_code not in RETRY_STATUSES or attempt > self.max_retries:
+                    response.raise_for_status()
+                    self._remember(url, response)
+                    return HTTPResult(url, response.status_code, response.text, dict(response.headers),
+                                      attempts=attempt)
+                retry_after = response.headers.get('Retry-After')
+
+            delay = self.backoff_delay(attempt - 1)
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            if delay >= deadline - time.monotonic():
+                raise requests.Timeout(f'No answer from {url} within {timeout}s')
+            time.sleep(delay)
+
+    def _remember(self, url, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self.lock:
+            if etag or last_modified:
+                self.validators[url] = {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'text': response.text,
+                    'headers': dict(response.headers)
+                }
+            else:
+                self.validators.pop(url, None)
+
+
+# Global instance
+http_client = PriceHTTPClient()
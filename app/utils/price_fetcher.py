@@ -1,14 +1,25 @@
 import requests
-import json
+import copy
+import threading
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from app import db
+from app.utils.http_client import http_client
+from app.utils.price_scraper import scrape_prices
+from app.utils.price_store import price_store
 
 class NigerianPriceFetcher:
-    def __init__(self):
+    def __init__(self, source_timeout=5, fetch_deadline=8, live=False, http=http_client):
         self.cache_duration = timedelta(hours=4)  # 4 hours cache for building materials
+        self.source_timeout = source_timeout  # seconds, unless a source sets its own 'timeout'
+        self.fetch_deadline = fetch_deadline  # seconds for the whole refresh
+        self.live = live  # query the sources over HTTP instead of simulating them
+        self.http = http
+        self.parsed_sources = {}  # url -> prices parsed from its last body, reused on a 304
+        self.parsed_sources_lock = threading.Lock()
+        self.last_fetch_status = {}  # source name -> {'status', 'seconds', 'error'}
         self.price_sources = [
             {
                 'name': 'Nigerian Building Materials Index',
@@ -52,20 +63,7 @@ class NigerianPriceFetcher:
                 return cached_prices['prices']
             
             # Fetch from multiple sources
-            source_data = {}
-            for source in self.price_sources:
-                try:
-                    if source['type'] == 'api':
-                        prices = self.fetch_api_prices(source)
-                    else:
-                        prices = self.web_scrape_prices(source['url'])
-                    
-                    if prices:
-                        source_data[source['name']] = prices
-                    time.sleep(1)  # Rate limiting
-                except Exception as e:
-                    print(f"Error from {source['name']}: {e}")
-                    continue
+            source_data = self.fetch_sources()
 
             # If no live data, use our curated Nigerian market data
             if not source_data:
@@ -170,10 +168,84 @@ class NigerianPriceFetcher:
         
         return base_prices
 
-    def fetch_api_prices(self, source):
-        """Fetch prices from API endpoints (simulated for now)"""
-        # In production, this would make actual API calls
-        # For now, return our curated data with slight variations
+    def configure(self, source_timeout=None, fetch_deadline=None, live=None):
+        """Change the per-source timeout, the overall refresh deadline and/or live fetching"""
+        if source_timeout is not None:
+            self.source_timeout = source_timeout
+        if fetch_deadline is not None:
+            self.fetch_deadline = fetch_deadline
+        if live is not None:
+            self.live = live
+    
+    def fetch_source(self, source, timeout):
+        """Fetch one source's prices; timeout is passed on to its network call.
+        
+        Scraped sources may set 'rules', the price_scraper extraction rule
+        of their pages (a material / low / high table by default).
+        """
+        if source['type'] == 'api':
+            return self.fetch_api_prices(source, timeout=timeout)
+        return self.web_scrape_prices(source['url'], timeout=timeout, rules=source.get('rules'))
+    
+    def fetch_sources(self):
+        """Fetch every price source concurrently; returns {source name: prices}.
+        
+        Each source gets its own timeout, capped by fetch_deadline for the
+        whole refresh. Sources that fail or are still running when their time
+        is up are left out, so aggregation works on whatever arrived in time.
+        The outcome per source is kept in last_fetch_status.
+        """
+        started = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=len(self.price_sources) or 1,
+                                      thread_name_prefix='price-source')
+        futures = {}
+        for source in self.price_sources:
+            timeout = min(source.get('timeout', self.source_timeout), self.fetch_deadline)
+            futures[executor.submit(self.fetch_source, source, timeout)] = (source, started + timeout)
+        
+        source_data = {}
+        status = {}
+        pending = set(futures)
+        try:
+            while pending:
+                now = time.monotonic()
+                for future in [future for future in pending if futures[future][1] <= now]:
+                    source = futures[future][0]
+                    pending.discard(future)
+                    status[source['name']] = {'status': 'timeout', 'seconds': round(now - started, 3)}
+                    print(f"Timed out waiting for {source['name']}")
+                if not pending:
+                    break
+                
+                next_deadline = min(futures[future][1] for future in pending)
+                done, pending = wait(pending, timeout=next_deadline - now, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = futures[future][0]
+                    seconds = round(time.monotonic() - started, 3)
+                    try:
+                        prices = future.result()
+                    except Exception as e:
+                        status[source['name']] = {'status': 'error', 'seconds': seconds, 'error': str(e)}
+                        print(f"Error from {source['name']}: {e}")
+                        continue
+                    status[source['name']] = {'status': 'ok' if prices else 'empty', 'seconds': seconds}
+                    if prices:
+                        source_data[source['name']] = prices
+        finally:
+            # Do not wait for sources that ran out of time
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        self.last_fetch_status = status
+        return source_data
+
+    def fetch_api_prices(self, source, timeout=None):
+        """Fetch prices from API endpoints (simulated unless live fetching is on)"""
+        if self.live:
+            result = self.http.get(source['url'], timeout=timeout or self.source_timeout,
+                                   headers={'X-API-Key': source.get('api_key', '')})
+            return self.parse_source(result, self.parse_api_prices)
+        
+        # Simulated: our curated data with slight variations
         base_prices = self.get_curated_nigerian_prices()
         
         # Add some random variation to simulate real API data
@@ -183,24 +255,14 @@ class NigerianPriceFetcher:
                 base_prices[key]['average_price'] = round(base_prices[key]['average_price'] * variation)
         
         return base_prices
-    def update_manual_prices(self, manual_prices):
+    def update_manual_prices(self, manual_prices, updated_by=None):
         """Update prices manually via admin interface"""
         try:
             # Validate the manual prices structure
             validated_prices = self.validate_manual_prices(manual_prices)
             
-            # Create manual price cache
-            manual_cache = {
-                'prices': validated_prices,
-                'cached_at': datetime.utcnow().isoformat(),
-                'source': 'manual_admin_update',
-                'updated_by': 'admin',  # In real implementation, you'd track which admin
-                'is_manual': True
-            }
-            
-            # Save manual prices
-            with open('manual_price_cache.json', 'w') as f:
-                json.dump(manual_cache, f, indent=2)
+            # Save manual prices as a new snapshot (overrides fetched prices for 30 days)
+            price_store.save_manual(validated_prices, created_by=updated_by)
             
             return validated_prices
             
@@ -237,15 +299,12 @@ class NigerianPriceFetcher:
         return validated
 
     def get_manual_prices(self):
-        """Get manually set prices if they exist"""
-        try:
-            with open('manual_price_cache.json', 'r') as f:
-                cache_data = json.load(f)
-                if not self.is_cache_expired(cache_data, timedelta(days=30)):  # Manual prices last 30 days
-                    return cache_data['prices']
-        except FileNotFoundError:
-            return None
-        return None
+        """Get manually set prices if they exist and have not expired"""
+        return price_store.manual_prices()
+
+    def clear_manual_prices(self, updated_by=None):
+        """Drop the manual override so fetched prices apply again"""
+        price_store.clear_manual(created_by=updated_by)
 
     def fetch_current_prices(self):
         """Fetch current prices - manual prices take precedence"""
@@ -261,20 +320,7 @@ class NigerianPriceFetcher:
                 return cached_prices['prices']
             
             # Fetch fresh prices
-            source_data = {}
-            for source in self.price_sources:
-                try:
-                    if source['type'] == 'api':
-                        prices = self.fetch_api_prices(source)
-                    else:
-                        prices = self.web_scrape_prices(source['url'])
-                    
-                    if prices:
-                        source_data[source['name']] = prices
-                    time.sleep(1)
-                except Exception as e:
-                    print(f"Error from {source['name']}: {e}")
-                    continue
+            source_data = self.fetch_sources()
 
             if not source_data:
                 prices = self.get_curated_nigerian_prices()
@@ -288,6 +334,20 @@ class NigerianPriceFetcher:
             print(f"Price fetching error: {e}")
             return self.get_curated_nigerian_prices()
 
+    def refresh_prices(self):
+        """Fetch and aggregate fresh prices from the sources, ignoring every cache.
+        
+        Raises RuntimeError if no source answered in time, so the caller can
+        keep the prices it already has.
+        """
+        source_data = self.fetch_sources()
+        if not source_data:
+            raise RuntimeError('No price source responded in time')
+        
+        prices = self.aggregate_prices(source_data)
+        price_store.save_auto(prices)
+        return prices
+
     def is_cache_expired(self, cache_data, cache_duration=None):
         """Check if cache is expired with optional custom duration"""
         if cache_duration is None:
@@ -298,39 +358,92 @@ class NigerianPriceFetcher:
             return datetime.utcnow() - cached_at > cache_duration
         except:
             return True
-    def web_scrape_prices(self, url):
-        """Web scrape prices from Nigerian construction sites"""
-        try:
-            # This would contain actual web scraping logic
-            # For now, return our curated data
-            return self.get_curated_nigerian_prices()
-        except:
-            return self.get_curated_nigerian_prices()
+    def web_scrape_prices(self, url, timeout=None, rules=None):
+        """Web scrape prices from Nigerian construction sites (simulated unless live fetching is on)"""
+        if self.live:
+            result = self.http.get(url, timeout=timeout or self.source_timeout)
+            return self.parse_source(result, lambda result: self.parse_price_page(result, rules))
+        return self.get_curated_nigerian_prices()
+    
+    def parse_source(self, result, parser):
+        """Parse an HTTPResult, reusing the previous parse when the source answered 304"""
+        with self.parsed_sources_lock:
+            parsed = self.parsed_sources.get(result.url) if result.not_modified else None
+        if parsed is None:
+            parsed = parser(result)
+            with self.parsed_sources_lock:
+                self.parsed_sources[result.url] = parsed
+        return copy.deepcopy(parsed)
+    
+    def parse_api_prices(self, result):
+        """Material entries ({material: {'price_range', 'average_price', ...}}) of an API answer"""
+        data = result.json()
+        data = data.get('prices', data) if isinstance(data, dict) else {}
+        return {
+            material: info for material, info in data.items()
+            if isinstance(info, dict) and ('price_range' in info or 'average_price' in info)
+        }
+    
+    def parse_price_page(self, result, rules=None):
+        """Prices of a scraped page, streamed through the source's extraction rules"""
+        materials = [material for material, info in self.get_curated_nigerian_prices().items()
+                     if isinstance(info, dict)]
+        return scrape_prices(result.text, materials, rules)
 
     def aggregate_prices(self, source_data):
-        """Aggregate prices from multiple sources"""
+        """Aggregate prices from multiple sources over the curated prices.
+        
+        Per material, price_range and average_price are the mean over the
+        sources that priced it, and each region's range is the mean over the
+        sources that listed that region. Materials and regions no source
+        answered for keep their curated values.
+        """
         aggregated = self.get_curated_nigerian_prices()
+        for material, base in aggregated.items():
+            if not isinstance(base, dict):
+                continue  # metadata such as last_updated
+            entries = [prices[material] for prices in source_data.values()
+                       if isinstance(prices.get(material), dict)]
+            
+            ranges = [entry['price_range'] for entry in entries if _is_price_range(entry.get('price_range'))]
+            if ranges:
+                base['price_range'] = [_mean(low for low, _ in ranges), _mean(high for _, high in ranges)]
+            averages = [entry['average_price'] for entry in entries if _is_number(entry.get('average_price'))]
+            if averages:
+                base['average_price'] = _mean(averages)
+            elif ranges:
+                base['average_price'] = _mean(base['price_range'])
+            
+            regions = {}
+            for entry in entries:
+                for region, price_range in (entry.get('region_variation') or {}).items():
+                    if _is_price_range(price_range):
+                        regions.setdefault(region, []).append(price_range)
+            if regions:
+                variation = base.setdefault('region_variation', {})
+                for region, region_ranges in regions.items():
+                    variation[region] = [_mean(low for low, _ in region_ranges),
+                                         _mean(high for _, high in region_ranges)]
+        
         aggregated['sources_used'] = list(source_data.keys())
         return aggregated
 
     def get_cached_prices(self):
-        """Get cached prices"""
-        try:
-            with open('price_cache.json', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
+        """Get the latest fetched prices as {'prices', 'cached_at'}"""
+        snapshot = price_store.auto_snapshot()
+        if snapshot is None:
             return None
+        return {
+            'prices': price_store.auto_prices(),
+            'cached_at': snapshot['created_at'].isoformat()
+        }
 
     def cache_prices(self, prices):
-        """Cache prices"""
+        """Store fetched prices as a new snapshot"""
         try:
-            cache_data = {
-                'prices': prices,
-                'cached_at': datetime.utcnow().isoformat()
-            }
-            with open('price_cache.json', 'w') as f:
-                json.dump(cache_data, f, indent=2)
+            price_store.save_auto(prices)
         except Exception as e:
+            db.session.rollback()
             print(f"Caching error: {e}")
 
     def is_cache_expired(self, cache_data):
@@ -342,11 +455,29 @@ class NigerianPriceFetcher:
             return True
     
 
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_price_range(value):
+    return isinstance(value, (list, tuple)) and len(value) == 2 and all(_is_number(v) for v in value)
+
+
+def _mean(values):
+    values = list(values)
+    return round(sum(values) / len(values))
+
+
 # Global instance
 price_fetcher = NigerianPriceFetcher()
 
 def get_current_prices():
-    return price_fetcher.fetch_current_prices()
+    """Current prices from the background refresher's snapshot (never fetches)"""
+    from app.utils.price_refresher import price_refresher
+    return price_refresher.get_prices()
 
 def update_prices_manually():
-    return price_fetcher.fetch_current_prices()
\ No newline at end of file
+    """Start a refresh from the sources in the background"""
+    from app.utils.price_refresher import price_refresher
+    price_refresher.trigger()
+    return price_refresher.get_prices()
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+Price history time series.
+
+Every price snapshot is expanded into PricePoint rows (one per material, plus
+one per regional range) in the same transaction that stores the snapshot.
+Rows are only appended; range queries use the (material, region,
+recorded_at) index and downsampling to daily/weekly min/avg/max happens in
+SQL, so history never needs truncating.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from app.models import PricePoint, PriceSnapshot
+
+NATIONAL = 'national'
+BUCKETS = ('raw', 'day', 'week')
+
+
+def _as_number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _price_range(value):
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        low, high = _as_number(value[0]), _as_number(value[1])
+        if low is not None and high is not None:
+            return low, high
+    return None, None
+
+
+def price_points_from_prices(prices):
+    """(material, region, price, price_min, price_max) for every price in a snapshot"""
+    points = []
+    for material, info in (prices or {}).items():
+        if not isinstance(info, dict):
+            continue  # metadata such as last_updated
+        price = _as_number(info.get('average_price'))
+        if price is None:
+            continue
+        low, high = _price_range(info.get('price_range'))
+        points.append((material, NATIONAL, price, low, high))
+
+        for region, region_range in (info.get('region_variation') or {}).items():
+            low, high = _price_range(region_range)
+            if low is not None:
+                points.append((material, region, (low + high) / 2, low, high))
+    return points
+
+
+def record_price_points(snapshot_id, prices, source, recorded_at=None):
+    """Queue the history rows of a snapshot in the current session (committed by the caller)"""
+    recorded_at = recorded_at or datetime.utcnow()
+    db.session.bulk_insert_mappings(PricePoint, [
+        {
+            'material': material,
+            'region': region,
+            'price': price,
+            'price_min': low,
+            'price_max': high,
+            'source': source,
+            'recorded_at': recorded_at,
+            'snapshot_id': snapshot_id
+        }
+        for material, region, price, low, high in price_points_from_prices(prices)
+    ])
+
+
+def _week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _as_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def get_price_series(material, region=NATIONAL, start=None, end=None, bucket='day'):
+    """Price points of one material/region between start and end (datetimes).
+
+    bucket 'raw' returns every point; 'day' and 'week' return one
+    {period, min, avg, max, count} row per day / ISO week (weeks start on
+    Monday). Days are aggregated in SQL, weeks are rolled up from the days.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+
+    filters = [PricePoint.material == material, PricePoint.region == region]
+    if start is not None:
+        filters.append(PricePoint.recorded_at >= start)
+    if end is not None:
+        filters.append(PricePoint.recorded_at < end)
+
+    if bucket == 'raw':
+        points = PricePoint.query.filter(*filters).order_by(PricePoint.recorded_at).all()
+        return [point.to_dict() for point in points]
+
+    day = func.date(PricePoint.recorded_at)
+    rows = db.session.query(
+        day,
+        func.min(PricePoint.price),
+        func.sum(PricePoint.price),
+        func.max(PricePoint.price),
+        func.count(PricePoint.id)
+    ).filter(*filters).group_by(day).order_by(day).all()
+
+    periods = {}
+    for period, low, total, high, count in rows:
+        period = _as_date(period)
+        if bucket == 'week':
+            period = _week_start(period)
+        current = periods.get(period)
+        if current is None:
+            periods[period] = [low, total, high, count]
+        else:
+            current[0] = min(current[0], low)
+            current[1] += total
+            current[2] = max(current[2], high)
+            current[3] += count
+
+    return [
+        {
+            'period': period.isoformat(),
+            'min': low,
+            'avg': round(total / count, 2),
+            'max': high,
+            'count': count
+        }
+        for period, (low, total, high, count) in sorted(periods.items())
+    ]
+
+
+def get_price_series_options():
+    """Materials and regions that have history, for the trend chart selectors"""
+    materials = [row[0] for row in db.session.query(PricePoint.material).distinct().order_by(PricePoint.material)]
+    regions = [row[0] for row in db.session.query(PricePoint.region).distinct().order_by(PricePoint.region)]
+    return {'materials': materials, 'regions': regions}
+
+
+def get_price_audit_log(limit=50, offset=0):
+    """Manual price updates and resets, newest first (from the snapshot table)"""
+    snapshots = PriceSnapshot.query.filter_by(kind='manual')\
+        .order_by(PriceSnapshot.id.desc())\
+        .offset(offset).limit(limit).all()
+    return [
+        {
+            'timestamp': snapshot.created_at.isoformat(),
+            'user_id': snapshot.created_by,
+            'action': 'manual_update' if snapshot.prices is not None else 'reset_to_auto',
+            'snapshot_id': snapshot.id
+        }
+        for snapshot in snapshots
+    ]
@@ -0,0 +1,214 @@
+"""
+Background price refresher.
+
+A daemon thread renews prices from the sources well before the 4-hour cache
+expires and stores them as a new PriceSnapshot, and requests read the last
+good snapshot through the in-memory price store, so no request ever waits on
+the price sources. A failed refresh keeps the previous snapshot and is
+retried after retry_interval. Manual admin prices still take precedence.
+
+Every worker process runs a refresher, but a refresh first takes the
+'price_refresh' Lease, so exactly one worker queries the sources while the
+others keep serving the current snapshot and pick up the new one when it
+lands.
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Lease
+from app.utils.cache import invalidate_tags
+from app.utils.price_fetcher import price_fetcher
+from app.utils.price_store import price_store
+
+
+def _isoformat(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+# Name of the cross-worker lease held while refreshing
+LEASE_NAME = 'price_refresh'
+
+
+def _timestamp(value):
+    """Unix time of a naive UTC datetime"""
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+class PriceRefresher:
+    """Keeps the stored price snapshot fresh from a background thread"""
+
+    def __init__(self, fetcher, store, refresh_interval=3 * 3600, retry_interval=300,
+                 lease_ttl=timedelta(seconds=60), lease_poll_interval=10):
+        self.fetcher = fetcher
+        self.store = store
+        self.refresh_interval = refresh_interval  # seconds between successful refreshes
+        self.retry_interval = retry_interval  # seconds before retrying a failed refresh
+        self.lease_ttl = lease_ttl  # longer than any refresh can take
+        self.lease_poll_interval = lease_poll_interval  # seconds between looks while another worker refreshes
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_attempt = None
+        self.last_success = None
+        self.last_error = None
+        self.last_error_at = None
+        self.refreshing = False
+        self.forced = False
+        self.next_refresh = time.time()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None  # process the thread was started in
+        self.app = None
+
+    def configure(self, refresh_interval=None, retry_interval=None, lease_ttl=None):
+        """Change the refresh and retry intervals and/or the lease TTL"""
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+        if retry_interval is not None:
+            self.retry_interval = retry_interval
+        if lease_ttl is not None:
+            self.lease_ttl = lease_ttl
+
+    def start(self, app):
+        """Start the refresher thread (once per process, again in a forked child)"""
+        pid = os.getpid()
+        if self.pid == pid and self.thread.is_alive():
+            return False
+        with self.lock:
+            if self.pid == pid and self.thread.is_alive():
+                return False
+            self.pid = pid
+            self.holder = f"{socket.gethostname()}:{pid}"
+            self.app = app
+            self.thread = threading.Thread(target=self._run, name='price-refresher', daemon=True)
+            self.thread.start()
+            return True
+
+    def trigger(self):
+        """Ask the thread to refresh now; returns at once"""
+        self.forced = True
+        self.next_refresh = time.time()
+        self.wakeup.set()
+
+    def get_prices(self):
+        """Manual prices if set, else the last good snapshot. Never fetches."""
+        manual_prices = self.fetcher.get_manual_prices()
+        if manual_prices:
+            return manual_prices
+
+        prices = self.store.auto_prices()
+        if prices is None:
+            # Nothing fetched yet: serve the curated prices until the thread has run
+            self.trigger()
+            return self.fetcher.get_curated_nigerian_prices()
+        return prices
+
+    def refresh(self):
+        """Fetch from the sources into a new snapshot; returns True on success"""
+        self.refreshing = True
+        self.last_attempt = time.time()
+        try:
+            self.fetcher.refresh_prices()
+        except Exception as e:
+            db.session.rollback()
+            self.last_error = str(e)
+            self.last_error_at = time.time()
+            self.next_refresh = time.time() + self.retry_interval
+            print(f"Price refresh failed: {e}")
+            return False
+        finally:
+            self.refreshing = False
+
+        self.last_success = time.time()
+        self.next_refresh = self.last_success + self.refresh_interval
+        try:
+            invalidate_tags('prices')
+        except Exception as e:
+            # The snapshot is stored; cached prices expire on their own
+            print(f"Could not invalidate cached prices: {e}")
+        return True
+
+    def status(self):
+        """Refresh status for the admin prices page"""
+        snapshot = self.store.auto_snapshot()
+        fetched_at = _timestamp(snapshot['created_at']) if snapshot else None
+        lease = Lease.query.get(LEASE_NAME)
+        lease_active = lease is not None and lease.expires_at > datetime.utcnow()
+        return {
+            'running': self.thread is not None and self.thread.is_alive(),
+            'worker': self.holder,
+            'lease_holder': lease.holder if lease_active else None,
+            'refreshing': self.refreshing,
+            'has_snapshot': snapshot is not None,
+            'snapshot_id': snapshot['id'] if snapshot else None,
+            'fetched_at': _isoformat(fetched_at),
+            'age_seconds': round(time.time() - fetched_at) if fetched_at else None,
+            'last_attempt': _isoformat(self.last_attempt),
+            'last_success': _isoformat(self.last_success),
+            'last_error': self.last_error,
+            'last_error_at': _isoformat(self.last_error_at),
+            'next_refresh': _isoformat(self.next_refresh),
+            'sources': dict(self.fetcher.last_fetch_status)
+        }
+
+    def _snapshot_is_fresh(self):
+        """True (and reschedule) if a recent enough snapshot is already stored,
+        e.g. from before a restart or by another worker"""
+        if self.forced:
+            return False
+        try:
+            snapshot = self.store.auto_snapshot()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not read the price snapshot: {e}")
+            return False
+        if snapshot is None:
+            return False
+        due = _timestamp(snapshot['created_at']) + self.refresh_interval
+        if due <= time.time():
+            return False
+        self.next_refresh = due
+        return True
+
+    def _acquire_lease(self):
+        try:
+            return Lease.acquire(LEASE_NAME, self.holder, self.lease_ttl)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not take the price refresh lease: {e}")
+            return False
+
+    def _release_lease(self):
+        try:
+            Lease.release(LEASE_NAME, self.holder)
+        except Exception as e:
+            # It expires on its own
+            db.session.rollback()
+            print(f"Could not release the price refresh lease: {e}")
+
+    def _run(self):
+        while True:
+            delay = self.next_refresh - time.time()
+            if delay > 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+            with self.app.app_context():
+                if self._snapshot_is_fresh():
+                    continue
+                self.forced = False
+                if not self._acquire_lease():
+                    # Another worker is refreshing; its snapshot is picked up on the next look
+                    self.next_refresh = time.time() + self.lease_poll_interval
+                    continue
+                try:
+                    self.refresh()
+                finally:
+                    self._release_lease()
+
+
+# Global instance
+price_refresher = PriceRefresher(price_fetcher, price_store)
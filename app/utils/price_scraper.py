@@ -0,0 +1,182 @@
+"""
+Streaming price page scraper.
+
+Pages are fed in chunks to lxml's HTML parser with a parser target, which
+receives start/data/end events and never builds a document tree. What to
+extract is declared per source as a rule:
+
+    {
+        'record': {'tag': 'tr', 'class': 'price-row'},  # class is optional
+        'fields': {
+            'material': 0,          # text of the record's first cell (td/th)
+            'low': 1,
+            'high': '.max-price',   # text of the first descendant with this class
+            'region': '@data-city'  # attribute of the record element
+        }
+    }
+
+Every record element yields a dict of the field texts, and
+records_to_prices() turns those into the price structure of
+get_curated_nigerian_prices(). A record's price is the lowest and highest
+number in its non-text fields, so one 'price' cell reading '5,000 - 6,000'
+works as well as separate low/high cells.
+"""
+import re
+
+from lxml import etree
+
+# Plain table: material name, then its low and high price
+DEFAULT_RULE = {
+    'record': {'tag': 'tr'},
+    'fields': {'material': 0, 'low': 1, 'high': 2}
+}
+
+CELL_TAGS = ('td', 'th')
+TEXT_FIELDS = ('material', 'region')
+CHUNK_SIZE = 64 * 1024
+
+_NUMBER = re.compile(r'\d[\d,]*(?:\.\d+)?')
+_SPACES = re.compile(r'\s+')
+
+
+class PriceRecordTarget:
+    """lxml parser target that collects one dict per record element of a rule"""
+
+    def __init__(self, rule):
+        record = rule['record']
+        self.record_tag = record['tag']
+        self.record_class = record.get('class')
+        self.cell_fields = {}  # cell index -> field
+        self.class_fields = {}  # class name -> field
+        self.attribute_fields = {}  # attribute -> field
+        for field, selector in rule['fields'].items():
+            if isinstance(selector, int):
+                self.cell_fields[selector] = field
+            elif selector.startswith('.'):
+                self.class_fields[selector[1:]] = field
+            elif selector.startswith('@'):
+                self.attribute_fields[selector[1:]] = field
+            else:
+                raise ValueError(f"Bad selector for {field!r}: {selector!r}")
+
+        self.records = []
+        self.depth = 0
+        self.record_depth = None  # depth of the open record element
+        self.cell_depth = None  # depth of the open cell of the record
+        self.cell_index = -1
+        self.captures = []  # [field, depth] of the elements whose text is being collected
+        self.values = None
+
+    def _classes(self, attrib):
+        return (attrib.get('class') or '').split()
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        if self.record_depth is None:
+            if tag == self.record_tag and (self.record_class is None or
+                                           self.record_class in self._classes(attrib)):
+                self.record_depth = self.depth
+                self.cell_index = -1
+                self.values = {
+                    field: attrib[attribute]
+                    for attribute, field in self.attribute_fields.items()
+                    if attribute in attrib
+                }
+            return
+
+        if tag in CELL_TAGS and self.cell_depth is None:
+            self.cell_index += 1
+            self.cell_depth = self.depth
+            field = self.cell_fields.get(self.cell_index)
+            if field is not None:
+                self.captures.append([field, self.depth])
+        for class_name in self._classes(attrib):
+            field = self.class_fields.get(class_name)
+            if field is not None and field not in self.values:
+                self.values[field] = ''
+                self.captures.append([field, self.depth])
+
+    def data(self, text):
+        for field, _ in self.captures:
+            self.values[field] = self.values.get(field, '') + text
+
+    def end(self, tag):
+        if self.captures:
+            self.captures = [capture for capture in self.captures if capture[1] != self.depth]
+        if self.cell_depth == self.depth:
+            self.cell_depth = None
+        if self.record_depth == self.depth:
+            self.records.append({field: _SPACES.sub(' ', value).strip() for field, value in self.values.items()})
+            self.record_depth = None
+            self.values = None
+        self.depth -= 1
+
+    def close(self):
+        return self.records
+
+
+def iter_records(chunks, rule=DEFAULT_RULE):
+    """Yield the records of an HTML page given as an iterable of str/bytes chunks,
+    as soon as each record element closes"""
+    target = PriceRecordTarget(rule)
+    parser = etree.HTMLParser(target=target)
+    for chunk in chunks:
+        parser.feed(chunk)
+        if target.records:
+            yield from target.records
+            target.records = []
+    parser.close()
+    yield from target.records
+
+
+def iter_text_chunks(text, size=CHUNK_SIZE):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def parse_price(value):
+    """(low, high) of the numbers in a text, or None"""
+    numbers = [float(number.replace(',', '')) for number in _NUMBER.findall(value or '')]
+    return (min(numbers), max(numbers)) if numbers else None
+
+
+def records_to_prices(records, materials):
+    """Prices of the records naming one of materials (keys like '9_inch_hollow').
+
+    Material names match case-insensitively with '_', '-' and spaces
+    interchangeable. A record with a region goes to that material's
+    region_variation; otherwise it sets the national price_range. A
+    material listed only by region gets a national range spanning them.
+    """
+    names = {_SPACES.sub(' ', material.replace('_', ' ')): material for material in materials}
+    prices = {}
+    for record in records:
+        name = _SPACES.sub(' ', re.sub(r'[_-]', ' ', record.get('material', '').lower())).strip()
+        material = names.get(name)
+        if material is None:
+            continue
+        price = parse_price(' '.join(value for field, value in record.items() if field not in TEXT_FIELDS))
+        if price is None:
+            continue
+
+        low, high = price
+        entry = prices.setdefault(material, {})
+        if record.get('region'):
+            entry.setdefault('region_variation', {})[record['region']] = [low, high]
+        else:
+            entry['price_range'] = [low, high]
+            entry['average_price'] = round((low + high) / 2)
+
+    for entry in prices.values():
+        if 'price_range' not in entry:
+            # Only regional prices: the national range spans them
+            ranges = entry['region_variation'].values()
+            low, high = min(price[0] for price in ranges), max(price[1] for price in ranges)
+            entry['price_range'] = [low, high]
+            entry['average_price'] = round((low + high) / 2)
+    return prices
+
+
+def scrape_prices(text, materials, rule=None):
+    """Prices of a price page, parsed in chunks with the source's rule"""
+    return records_to_prices(iter_records(iter_text_chunks(text), rule or DEFAULT_RULE), materials)
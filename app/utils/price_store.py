@@ -0,0 +1,181 @@
+"""
+Versioned price snapshot store.
+
+Prices are kept as immutable PriceSnapshot rows shared by every worker
+process, replacing the price_cache.json / manual_price_cache.json files that
+workers used to rewrite and re-parse in the current directory. Each process
+holds the latest snapshots in memory; a lookup only compares the store's
+version (the highest snapshot id, a primary key lookup) and re-reads the rows
+when another write happened.
+
+Snapshots never change once written, so any snapshot looked up by id (e.g.
+the one a project's costs are pinned to) is kept in memory without checks.
+
+An unexpired override left in manual_price_cache.json by earlier versions is
+imported as a manual snapshot the first time a process reads the store, as
+long as no manual snapshot exists yet.
+"""
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from app.models import PriceSnapshot
+from app.utils.price_history import record_price_points
+
+# How long a manual admin override applies before fetched prices take over again
+MANUAL_PRICES_TTL = timedelta(days=30)
+
+# Snapshots kept in memory by id
+MAX_CACHED_SNAPSHOTS = 64
+
+# Admin override file written before prices were stored as snapshots
+LEGACY_MANUAL_PRICES_FILE = 'manual_price_cache.json'
+
+
+def _detach(snapshot):
+    """Plain dict copy of a snapshot row, safe to keep across sessions"""
+    if snapshot is None:
+        return None
+    return {
+        'id': snapshot.id,
+        'kind': snapshot.kind,
+        'prices': snapshot.prices,
+        'data_source': snapshot.data_source,
+        'created_at': snapshot.created_at,
+        'expires_at': snapshot.expires_at,
+        'created_by': snapshot.created_by
+    }
+
+
+class PriceSnapshotStore:
+    """In-memory view of the latest auto and manual price snapshots"""
+
+    def __init__(self):
+        self.version = None  # highest snapshot id seen
+        self.auto = None  # latest fetched snapshot
+        self.manual = None  # latest manual snapshot (prices None = override cleared)
+        self.snapshots = OrderedDict()  # id -> snapshot, least recently used first
+        self.lock = threading.Lock()
+
+    def current_version(self):
+        return db.session.query(func.max(PriceSnapshot.id)).scalar() or 0
+
+    def sync(self):
+        """Reload the latest snapshots if the store changed since the last lookup"""
+        if self.version is None:
+            try:
+                self.import_legacy_manual_prices()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Could not import {LEGACY_MANUAL_PRICES_FILE}: {e}")
+        version = self.current_version()
+        if version == self.version:
+            return
+
+        latest = PriceSnapshot.query.order_by(PriceSnapshot.id.desc())
+        auto = _detach(latest.filter_by(kind='auto').first())
+        manual = _detach(latest.filter_by(kind='manual').first())
+        with self.lock:
+            self.auto = auto
+            self.manual = manual
+            self.version = version
+
+    def auto_snapshot(self):
+        """Latest fetched snapshot as a dict (shared - do not modify), or None"""
+        self.sync()
+        return self.auto
+
+    def auto_prices(self):
+        snapshot = self.auto_snapshot()
+        return copy.deepcopy(snapshot['prices']) if snapshot else None
+
+    def active_manual_snapshot(self):
+        """The admin override snapshot if one is set and has not expired, else None"""
+        self.sync()
+        manual = self.manual
+        if manual is None or manual['prices'] is None:
+            return None
+        if manual['expires_at'] is not None and manual['expires_at'] <= datetime.utcnow():
+            return None
+        return manual
+
+    def manual_prices(self):
+        manual = self.active_manual_snapshot()
+        return copy.deepcopy(manual['prices']) if manual else None
+
+    def current_snapshot_id(self):
+        """Id of the snapshot current prices come from (override first), or None
+        while nothing has been stored"""
+        snapshot = self.active_manual_snapshot() or self.auto
+        return snapshot['id'] if snapshot else None
+
+    def snapshot(self, snapshot_id):
+        """Snapshot by id as a dict (shared - do not modify), or None"""
+        with self.lock:
+            snapshot = self.snapshots.get(snapshot_id)
+            if snapshot is not None:
+                self.snapshots.move_to_end(snapshot_id)
+                return snapshot
+
+        snapshot = _detach(PriceSnapshot.query.get(snapshot_id))
+        if snapshot is not None:
+            with self.lock:
+                self.snapshots[snapshot_id] = snapshot
+                while len(self.snapshots) > MAX_CACHED_SNAPSHOTS:
+                    self.snapshots.popitem(last=False)
+        return snapshot
+
+    def save(self, kind, prices, data_source=None, created_by=None, expires_at=None):
+        """Insert a new snapshot and its price history points; returns the new version"""
+        snapshot = PriceSnapshot(
+            kind=kind,
+            prices=prices,
+            data_source=data_source,
+            created_by=created_by,
+            expires_at=expires_at,
+            created_at=datetime.utcnow()
+        )
+        db.session.add(snapshot)
+        if prices is not None:
+            db.session.flush()
+            record_price_points(snapshot.id, prices, kind, recorded_at=snapshot.created_at)
+        db.session.commit()
+        self.sync()
+        return snapshot.id
+
+    def save_auto(self, prices):
+        return self.save('auto', prices, data_source=prices.get('data_source'))
+
+    def save_manual(self, prices, created_by=None):
+        return self.save('manual', prices, data_source='manual_admin_update', created_by=created_by,
+                         expires_at=datetime.utcnow() + MANUAL_PRICES_TTL)
+
+    def clear_manual(self, created_by=None):
+        """Remove the admin override so fetched prices apply again"""
+        return self.save('manual', None, data_source='reset_to_auto', created_by=created_by)
+
+    def import_legacy_manual_prices(self, path=LEGACY_MANUAL_PRICES_FILE):
+        """Store an unexpired override from a manual_price_cache.json file as a
+        manual snapshot, unless one already exists; returns its id or None"""
+        if not os.path.exists(path):
+            return None
+        if PriceSnapshot.query.filter_by(kind='manual').first() is not None:
+            return None
+
+        with open(path) as f:
+            cache_data = json.load(f)
+        expires_at = datetime.fromisoformat(cache_data['cached_at']) + MANUAL_PRICES_TTL
+        if not cache_data.get('prices') or expires_at <= datetime.utcnow():
+            return None
+        return self.save('manual', cache_data['prices'], data_source='manual_admin_update',
+                         expires_at=expires_at)
+
+
+# Global instance
+price_store = PriceSnapshotStore()
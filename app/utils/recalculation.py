@@ -0,0 +1,198 @@
+"""
+Bulk recalculation of stored project results.
+
+Used when NIGERIAN_BLOCK_STANDARDS or the calculation rules change and every
+stored total goes stale. An admin starts a RecalculationJob; a background
+thread pages through the matching projects in id order, fans the calculator
+work out to a process pool in chunks and writes the results back with bulk
+UPDATEs, rewriting each project's metric ProjectStructure rows as it goes.
+The job's cursor is committed in the same transaction as each chunk, so a
+job whose process died can be resumed where it stopped.
+"""
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Lease, Project, ProjectStructure, RecalculationJob
+from app.utils.batch_calculator import recalculate_chunk
+from app.utils.calculator import STANDARDS_VERSION
+
+# Jobs with a live thread in this process
+_running_jobs = {}
+_running_jobs_lock = threading.Lock()
+
+# Lease held across every worker while checking for an active job and
+# starting or resuming one, so two requests cannot both start a job
+START_LEASE_NAME = 'recalculation_start'
+START_LEASE_TTL = timedelta(seconds=30)
+
+
+def build_project_query(filters):
+    """Projects matching a job's filters (house type, team, creation dates)"""
+    query = Project.query
+
+    if filters.get('house_type'):
+        query = query.filter(Project.house_type == filters['house_type'])
+    if filters.get('team_id'):
+        query = query.filter(Project.team_id == int(filters['team_id']))
+    if filters.get('created_after'):
+        query = query.filter(Project.created_at >= datetime.fromisoformat(filters['created_after']))
+    if filters.get('created_before'):
+        query = query.filter(Project.created_at < datetime.fromisoformat(filters['created_before']))
+
+    return query
+
+
+def clean_filters(data):
+    """Keep only the supported filters from request data, validating dates"""
+    filters = {}
+    for key in ['house_type', 'team_id', 'created_after', 'created_before']:
+        value = data.get(key)
+        if value in (None, ''):
+            continue
+        if key in ('created_after', 'created_before'):
+            datetime.fromisoformat(value)  # raises ValueError if malformed
+        if key == 'team_id':
+            value = int(value)
+        filters[key] = value
+    return filters
+
+
+def get_active_job(stale_after):
+    """The pending/running job that is still heartbeating, if any"""
+    for job in RecalculationJob.query.filter(RecalculationJob.status.in_(['pending', 'running'])).all():
+        if not job.is_interrupted(stale_after) or is_running_here(job.id):
+            return job
+    return None
+
+
+def acquire_start_lease():
+    """Take the start lease; returns its holder name, or None if another request holds it"""
+    holder = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    return holder if Lease.acquire(START_LEASE_NAME, holder, START_LEASE_TTL) else None
+
+
+def release_start_lease(holder):
+    Lease.release(START_LEASE_NAME, holder)
+
+
+def is_running_here(job_id):
+    with _running_jobs_lock:
+        thread = _running_jobs.get(job_id)
+        return thread is not None and thread.is_alive()
+
+
+def start_recalculation_job(app, filters, user_id=None):
+    """Create a job for the filtered projects and start it in the background"""
+    job = RecalculationJob(
+        status='pending',
+        filters=filters,
+        standards_version=STANDARDS_VERSION,
+        total_projects=build_project_query(filters).count(),
+        created_by=user_id
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _start_thread(app, job.id)
+    return job
+
+
+def resume_recalculation_job(app, job):
+    """Continue an interrupted or failed job from its cursor"""
+    job.status = 'pending'
+    job.error = None
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    _start_thread(app, job.id)
+    return job
+
+
+def _start_thread(app, job_id):
+    thread = threading.Thread(target=_run_job_thread, args=(app, job_id), daemon=True)
+    with _running_jobs_lock:
+        _running_jobs[job_id] = thread
+    thread.start()
+
+
+def _run_job_thread(app, job_id):
+    with app.app_context():
+        try:
+            run_recalculation_job(
+                job_id,
+                workers=app.config.get('RECALCULATION_WORKERS', 2),
+                chunk_size=app.config.get('RECALCULATION_CHUNK_SIZE', 200)
+            )
+        finally:
+            db.session.remove()
+            with _running_jobs_lock:
+                _running_jobs.pop(job_id, None)
+
+
+def run_recalculation_job(job_id, workers=2, chunk_size=200):
+    """Process a job to completion, committing progress after every chunk"""
+    job = db.session.get(RecalculationJob, job_id)
+    job.status = 'running'
+    job.started_at = job.started_at or datetime.utcnow()
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    query = build_project_query(job.filters or {})
+
+    try:
+        # Not forked: a child of this web worker would inherit its held locks,
+        # database connections and cache handles
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            while True:
+                # One page feeds every worker with a chunk
+                rows = query.with_entities(
+                    Project.id, Project.structures_data, Project.updated_at
+                ).filter(
+                    Project.id > job.last_project_id
+                ).order_by(Project.id).limit(chunk_size * workers).all()
+
+                if not rows:
+                    break
+
+                # Recalculating is not an edit, so keep updated_at as it was
+                updated_at = {row.id: row.updated_at for row in rows}
+                chunks = [
+                    [(row.id, row.structures_data or {}, (row.structures_data or {}).get('block_type', '9_inch_hollow'))
+                     for row in rows[start:start + chunk_size]]
+                    for start in range(0, len(rows), chunk_size)
+                ]
+
+                for chunk, (mappings, structure_rows, failed_ids) in zip(chunks, executor.map(recalculate_chunk, chunks)):
+                    for mapping in mappings:
+                        mapping['updated_at'] = updated_at[mapping['id']]
+                    if mappings:
+                        db.session.bulk_update_mappings(Project, mappings)
+                        ProjectStructure.query.filter(
+                            ProjectStructure.project_id.in_([mapping['id'] for mapping in mappings])
+                        ).delete(synchronize_session=False)
+                        db.session.bulk_insert_mappings(ProjectStructure, structure_rows)
+
+                    job.last_project_id = chunk[-1][0]
+                    job.processed_projects += len(chunk)
+                    job.failed_projects += len(failed_ids)
+                    job.updated_at = datetime.utcnow()
+                    db.session.commit()
+
+        job.status = 'completed'
+        job.finished_at = datetime.utcnow()
+        job.updated_at = job.finished_at
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Recalculation job {job_id} failed: {e}")
+        job = db.session.get(RecalculationJob, job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
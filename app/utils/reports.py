@@ -3,7 +3,9 @@ import io
 from datetime import datetime, timedelta  # Add timedelta
 from flask import render_template
 from weasyprint import HTML
+from app.models import Project
 from app.utils.calculator import BlockCalculator
+from app.utils.structure_specs import parse_structures_data, StructureValidationError
 
 class ReportGenerator:
     def __init__(self, project):
@@ -13,7 +15,9 @@ class ReportGenerator:
     def generate_pdf_report(self):
         """Generate a comprehensive PDF report"""
         # Calculate detailed breakdown
-        calculation_result = self.calculator.calculate()
+        calculation_result = self.project.get_calculation()
+        if not calculation_result:
+            raise ValueError('Project has no calculation')
         
         # Generate HTML content
         html_content = render_template(
@@ -30,8 +34,10 @@ class ReportGenerator:
         return pdf_file
     
     def generate_materials_list(self):
-        """Generate detailed materials list"""
-        calculation = self.calculator.calculate()
+        """Generate detailed materials list, or None if the project has no calculation"""
+        calculation = self.project.get_calculation()
+        if not calculation:
+            return None
         
         materials = {
             'blocks': {
@@ -113,20 +119,24 @@ def generate_comparison_report(projects):
         total_blocks_per_area = 0
         now = datetime.utcnow()
         
+        # Recalculate stale projects in one vectorised pass, reuse the rest
+        Project.refresh_stale_calculations(projects)
+        
         for project in projects:
-            # Ensure project has calculated values
-            if not project.total_blocks and project.structures_data.get('structures'):
-                project.calculate_blocks()
-            
-            calculator = BlockCalculator(project.structures_data)
-            calculation = calculator.calculate()
+            calculation = project.calculation_data
+            if not calculation:
+                continue  # never calculated and no longer validates
+            try:
+                specs = parse_structures_data(project.structures_data)
+            except StructureValidationError:
+                specs = []  # saved before validation; its stored result still counts
             
             # Calculate project metrics
             efficiency_score = calculate_efficiency_score(calculation)
-            space_utilization = min(100, (calculation.get('total_area', 0) / max(1, len(project.structures_data.get('structures', []))) * 10))
+            space_utilization = min(100, (calculation.get('total_area', 0) / max(1, len(specs)) * 10))
             material_utilization = max(0, 100 - calculation.get('waste_percentage', 10))
-            complexity_score = min(10, len(project.structures_data.get('structures', [])) * 0.5 + 
-                                  sum(len(s.get('sub_structures', [])) for s in project.structures_data.get('structures', [])) * 0.2)
+            complexity_score = min(10, len(specs) * 0.5 + 
+                                  sum(spec.sub_structure_count for spec in specs) * 0.2)
             
             # Calculate project age in days
             project_age = (now - project.created_at).days
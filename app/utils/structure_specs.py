@@ -0,0 +1,267 @@
+"""
+Typed, validated representation of a project's structures_data.
+
+structures_data is parsed once into compact StructureSpec/OpeningSpec
+objects with every dimension already converted to metres. Parsing checks the
+whole document in one pass and reports every problem by its path (e.g.
+"structures[2].sub_structures[0].width"), so bad input is rejected up front
+instead of failing half-way through a calculation.
+"""
+from app.utils.structure_templates import MEASUREMENT_UNITS
+
+# Sub-structure types that are cut out of the wall area
+OPENING_TYPES = ['door', 'window', 'ac_unit', 'vent']
+
+# Unit id -> metres factor; unknown units are taken to be metres already
+UNIT_FACTORS = {unit_info['id']: unit_info['conversion_to_meters'] for unit_info in MEASUREMENT_UNITS}
+
+# Longest values the ProjectStructure columns hold
+MAX_NAME_LENGTH = 100
+MAX_TYPE_LENGTH = 50
+MAX_UNIT_LENGTH = 20
+
+
+class StructureValidationError(ValueError):
+    """structures_data failed validation; errors is a list of (path, message)"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f"{path}: {message}" for path, message in errors))
+
+    def to_dict(self):
+        return {
+            'success': False,
+            'error': 'Invalid structures: ' + str(self),
+            'errors': [{'path': path, 'message': message} for path, message in self.errors]
+        }
+
+
+def to_meters(value, unit):
+    """Convert a length to metres (same rule as BlockCalculator.convert_to_meters)"""
+    factor = UNIT_FACTORS.get(unit)
+    return value * factor if factor is not None else value
+
+
+class OpeningSpec:
+    """An opening (door, window, ...) cut out of a structure's walls"""
+    __slots__ = ('type', 'width', 'height', 'unit', 'quantity', 'width_m', 'height_m', 'key')
+
+    def __init__(self, type, width, height, unit, quantity=1):
+        self.type = type
+        self.width = width
+        self.height = height
+        self.unit = unit
+        self.quantity = quantity
+        self.width_m = to_meters(width, unit)
+        self.height_m = to_meters(height, unit)
+        self.key = (type, width, height, unit, quantity)
+
+    @property
+    def area(self):
+        return self.width_m * self.height_m * self.quantity
+
+
+class StructureSpec:
+    """One structure (room, shop, ...) with its dimensions in metres"""
+    __slots__ = ('name', 'type', 'length', 'width', 'height', 'unit',
+                 'length_m', 'width_m', 'height_m', 'openings', 'sub_structure_count', 'key')
+
+    def __init__(self, name, type, length, width, height, unit, openings=(), sub_structure_count=None):
+        self.name = name
+        self.type = type
+        self.length = length
+        self.width = width
+        self.height = height
+        self.unit = unit
+        self.length_m = to_meters(length, unit)
+        self.width_m = to_meters(width, unit)
+        self.height_m = to_meters(height, unit)
+        self.openings = tuple(openings)
+        self.sub_structure_count = len(self.openings) if sub_structure_count is None else sub_structure_count
+        # Hashable key of every field the calculation reads
+        self.key = (name, type, length, width, height, unit,
+                    tuple(opening.key for opening in self.openings))
+
+    @property
+    def wall_area(self):
+        """Area of all 4 walls in m² (same formula as BlockCalculator.calculate_wall_area)"""
+        return (2 * self.length_m * self.height_m) + (2 * self.width_m * self.height_m)
+
+    @property
+    def openings_area(self):
+        total = 0
+        for opening in self.openings:
+            total += opening.area
+        return total
+
+    def to_row(self):
+        """Name, type, dimensions and unit as written to CSV exports"""
+        return [self.name, self.type, self.length, self.width, self.height, self.unit]
+
+    def to_metric_dict(self):
+        """Column values of the metric ProjectStructure row for this structure"""
+        wall_area = self.wall_area
+        openings_area = self.openings_area
+        return {
+            'name': self.name,
+            'structure_type': self.type,
+            'unit': self.unit,
+            'length_m': self.length_m,
+            'width_m': self.width_m,
+            'height_m': self.height_m,
+            'wall_area': wall_area,
+            'openings_area': openings_area,
+            'net_area': wall_area - openings_area,
+            'opening_count': int(sum(opening.quantity for opening in self.openings))
+        }
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _field_path(path, field):
+    return f"{path}.{field}" if path else field
+
+
+def _check_dimension(item, field, path, errors, required=True):
+    """Validate a non-negative number field, recording an error if invalid"""
+    if field not in item:
+        if required:
+            errors.append((_field_path(path, field), 'is required'))
+        return False
+    value = item[field]
+    if not _is_number(value):
+        errors.append((_field_path(path, field), 'must be a number'))
+        return False
+    if value < 0:
+        errors.append((_field_path(path, field), 'must not be negative'))
+        return False
+    return True
+
+
+def _check_string(item, field, path, errors, required=True, max_length=None):
+    """Validate a string field, recording an error if invalid"""
+    if field not in item:
+        if required:
+            errors.append((_field_path(path, field), 'is required'))
+        return False
+    if not isinstance(item[field], str):
+        errors.append((_field_path(path, field), 'must be a string'))
+        return False
+    if max_length is not None and len(item[field]) > max_length:
+        errors.append((_field_path(path, field), f'must be at most {max_length} characters'))
+        return False
+    return True
+
+
+def _parse_opening(sub_structure, path, errors):
+    error_count = len(errors)
+    _check_dimension(sub_structure, 'width', path, errors)
+    _check_dimension(sub_structure, 'height', path, errors)
+    _check_string(sub_structure, 'unit', path, errors)
+    _check_dimension(sub_structure, 'quantity', path, errors, required=False)
+
+    if len(errors) > error_count:
+        return None
+    return OpeningSpec(
+        sub_structure['type'],
+        sub_structure['width'],
+        sub_structure['height'],
+        sub_structure['unit'],
+        sub_structure.get('quantity', 1)
+    )
+
+
+def _parse_structure(structure, path, errors):
+    if not isinstance(structure, dict):
+        errors.append((path, 'must be an object'))
+        return None
+
+    error_count = len(errors)
+    _check_dimension(structure, 'length', path, errors)
+    _check_dimension(structure, 'width', path, errors)
+    _check_dimension(structure, 'height', path, errors)
+    _check_string(structure, 'unit', path, errors, max_length=MAX_UNIT_LENGTH)
+    _check_string(structure, 'name', path, errors, required=False, max_length=MAX_NAME_LENGTH)
+    _check_string(structure, 'type', path, errors, required=False, max_length=MAX_TYPE_LENGTH)
+
+    sub_structures = structure.get('sub_structures', [])
+    openings = []
+    if not isinstance(sub_structures, list):
+        errors.append((f"{path}.sub_structures", 'must be a list'))
+        sub_structures = []
+
+    for index, sub_structure in enumerate(sub_structures):
+        sub_path = f"{path}.sub_structures[{index}]"
+        if not isinstance(sub_structure, dict):
+            errors.append((sub_path, 'must be an object'))
+            continue
+        if not _check_string(sub_structure, 'type', sub_path, errors):
+            continue
+        # Other sub-structure types (wardrobes, stairs, ...) do not affect the walls
+        if sub_structure['type'] in OPENING_TYPES:
+            opening = _parse_opening(sub_structure, sub_path, errors)
+            if opening is not None:
+                openings.append(opening)
+
+    if len(errors) > error_count:
+        return None
+
+    return StructureSpec(
+        structure.get('name', 'Unnamed Structure'),
+        structure.get('type', 'unknown'),
+        structure['length'],
+        structure['width'],
+        structure['height'],
+        structure['unit'],
+        openings,
+        sub_structure_count=len(sub_structures)
+    )
+
+
+def parse_structures_data(structures_data):
+    """Validate structures_data and return its structures as StructureSpecs
+
+    Raises StructureValidationError listing every invalid field, with paths
+    relative to structures_data.
+    """
+    errors = []
+    if structures_data is None:
+        structures_data = {}
+    if not isinstance(structures_data, dict):
+        raise StructureValidationError([('', 'must be an object')])
+
+    _check_dimension(structures_data, 'waste_percentage', '', errors, required=False)
+
+    structures = structures_data.get('structures', [])
+    if not isinstance(structures, list):
+        errors.append(('structures', 'must be a list'))
+        structures = []
+
+    specs = []
+    for index, structure in enumerate(structures):
+        spec = _parse_structure(structure, f"structures[{index}]", errors)
+        if spec is not None:
+            specs.append(spec)
+
+    if errors:
+        raise StructureValidationError(errors)
+    return specs
+
+
+def structure_rows(structures_data):
+    """CSV rows (name, type, dimensions, unit) for every structure
+
+    Stored projects saved before validation existed may not parse; those
+    are exported as-is rather than failing the export.
+    """
+    try:
+        return [spec.to_row() for spec in parse_structures_data(structures_data)]
+    except StructureValidationError:
+        return [
+            [structure.get('name', ''), structure.get('type', ''), structure.get('length', ''),
+             structure.get('width', ''), structure.get('height', ''), structure.get('unit', '')]
+            for structure in (structures_data or {}).get('structures', [])
+            if isinstance(structure, dict)
+        ]
@@ -0,0 +1,82 @@
+"""
+Precomputed results for the built-in house type templates.
+
+HOUSE_TYPE_TEMPLATES never change at runtime, so every template is
+calculated once per block type and common waste percentage (in a single
+batch when the app starts) and kept in an in-memory table. The template API
+returns these totals inline, so loading an untouched template costs no
+calculation at all.
+"""
+import threading
+
+from app.utils.batch_calculator import calculate_many
+from app.utils.structure_templates import HOUSE_TYPE_TEMPLATES, NIGERIAN_BLOCK_STANDARDS
+
+# Waste percentages offered in the project builder
+COMMON_WASTE_PERCENTAGES = [5, 10, 15]
+
+# (house_type, block_type, waste_percentage) -> calculation result
+_template_results = {}
+_template_results_lock = threading.Lock()
+
+
+def template_structures_data(house_type, waste_percentage=10):
+    """structures_data for a template, as a project created from it would store"""
+    return {
+        'structures': HOUSE_TYPE_TEMPLATES[house_type]['structures'],
+        'waste_percentage': waste_percentage
+    }
+
+
+def build_template_results():
+    """Calculate every template x block type x common waste percentage.
+
+    The results also go through the shared calculation cache, so any
+    calculation of identical template data is a cache hit.
+    """
+    combinations = [
+        (house_type, block_type, waste_percentage)
+        for house_type in HOUSE_TYPE_TEMPLATES
+        for block_type in NIGERIAN_BLOCK_STANDARDS
+        for waste_percentage in COMMON_WASTE_PERCENTAGES
+    ]
+    results = calculate_many(
+        [template_structures_data(house_type, waste_percentage)
+         for house_type, _, waste_percentage in combinations],
+        block_type=[block_type for _, block_type, _ in combinations]
+    )
+
+    with _template_results_lock:
+        _template_results.clear()
+        _template_results.update(zip(combinations, results))
+
+    return len(combinations)
+
+
+def get_template_result(house_type, block_type='9_inch_hollow', waste_percentage=10):
+    """Precomputed result for an untouched template, or None if not in the table"""
+    if not _template_results and house_type in HOUSE_TYPE_TEMPLATES:
+        build_template_results()
+    return _template_results.get((house_type, block_type, waste_percentage))
+
+
+def get_template_totals(house_type):
+    """Totals of a template for every block type and common waste percentage
+
+    Returned as {block_type: {waste_percentage: totals}} without the
+    per-structure breakdown, small enough to send with the template itself.
+    """
+    totals = {}
+    for block_type in NIGERIAN_BLOCK_STANDARDS:
+        for waste_percentage in COMMON_WASTE_PERCENTAGES:
+            result = get_template_result(house_type, block_type, waste_percentage)
+            if result is None:
+                continue
+            totals.setdefault(block_type, {})[waste_percentage] = {
+                'total_blocks': result['total_blocks'],
+                'total_area': result['total_area'],
+                'waste_blocks': result['waste_blocks'],
+                'cement_bags': result['cement_bags'],
+                'sand_trucks': result['sand_trucks']
+            }
+    return totals
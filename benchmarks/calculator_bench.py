@@ -0,0 +1,305 @@
+"""
+Micro-benchmarks for the block calculator.
+
+Covers every HOUSE_TYPE_TEMPLATES entry plus synthetic projects of 10, 100,
+1,000 and 10,000 structures with varied openings and units. For each case it
+records ops/sec, the cost per structure and the tracemalloc peak of:
+
+    calculate        BlockCalculator.calculate() as the app runs it: DEBUG
+                     prints on (written to a null sink), structure memo cold
+    calculate_quiet  the same with the DEBUG prints silenced, so the
+                     difference is the cost of the prints
+    calculate_warm   prints silenced, structure memo already filled
+    parse            parse_structures_data() alone (validation + unit lookups)
+    batch            BatchBlockCalculator on the same project
+
+plus "templates/batch", every template calculated in one vectorised pass.
+
+Usage (from the repository root):
+
+    python benchmarks/calculator_bench.py --save benchmarks/baseline.json
+    python benchmarks/calculator_bench.py --compare benchmarks/baseline.json
+
+--compare exits with status 1 if any benchmark's ops/sec dropped, or its
+peak memory grew, by more than --threshold (default 20%). Baselines are
+machine specific; record one on the machine you compare on.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from app.utils import calculator as calculator_module
+from app.utils.batch_calculator import BatchBlockCalculator
+from app.utils.cache import structure_result_cache
+from app.utils.calculator import BlockCalculator, STANDARDS_VERSION
+from app.utils.structure_specs import OPENING_TYPES, parse_structures_data
+from app.utils.structure_templates import (
+    HOUSE_TYPE_TEMPLATES, MEASUREMENT_UNITS, STRUCTURE_TYPES, SUB_STRUCTURE_TYPES
+)
+
+SYNTHETIC_SIZES = [10, 100, 1000, 10000]
+
+# Peak memory below this is noise, never reported as a regression
+MIN_MEMORY_REGRESSION_KIB = 64
+
+
+class NullWriter:
+    """stdout replacement that discards everything (the prints still format)"""
+
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def quiet_print(*args, **kwargs):
+    pass
+
+
+def synthetic_project(structure_count, seed=0):
+    """Deterministic project with varied dimensions, units and openings"""
+    rng = random.Random(seed + structure_count)
+    units = [unit['id'] for unit in MEASUREMENT_UNITS]
+    structure_types = [structure_type['id'] for structure_type in STRUCTURE_TYPES]
+    other_sub_types = [sub_type['id'] for sub_type in SUB_STRUCTURE_TYPES]
+
+    structures = []
+    for index in range(structure_count):
+        unit = rng.choice(units)
+        scale = 1 / next(u['conversion_to_meters'] for u in MEASUREMENT_UNITS if u['id'] == unit)
+        sub_structures = []
+        for _ in range(rng.randint(0, 6)):
+            sub_type = rng.choice(OPENING_TYPES + other_sub_types[:10])
+            sub_unit = rng.choice(units)
+            sub_scale = 1 / next(u['conversion_to_meters'] for u in MEASUREMENT_UNITS if u['id'] == sub_unit)
+            sub_structures.append({
+                'type': sub_type,
+                'name': sub_type.replace('_', ' ').title(),
+                'width': round(rng.uniform(0.3, 2.4) * sub_scale, 2),
+                'height': round(rng.uniform(0.3, 2.4) * sub_scale, 2),
+                'unit': sub_unit,
+                'quantity': rng.randint(1, 4)
+            })
+        structures.append({
+            'type': rng.choice(structure_types),
+            'name': f'Structure {index + 1}',
+            'length': round(rng.uniform(2, 12) * scale, 2),
+            'width': round(rng.uniform(2, 10) * scale, 2),
+            'height': round(rng.uniform(2.4, 4) * scale, 2),
+            'unit': unit,
+            'sub_structures': sub_structures
+        })
+
+    return {'structures': structures, 'block_type': '9_inch_hollow', 'waste_percentage': 10}
+
+
+def build_cases(quick=False):
+    """(name, structures_data) for every template and synthetic size"""
+    cases = [
+        (f'template/{house_type}', {'structures': template['structures'], 'waste_percentage': 10})
+        for house_type, template in HOUSE_TYPE_TEMPLATES.items()
+    ]
+    sizes = SYNTHETIC_SIZES[:-1] if quick else SYNTHETIC_SIZES
+    cases.extend((f'synthetic/{size}', synthetic_project(size)) for size in sizes)
+    return cases
+
+
+def time_call(fn, setup=None, min_time=0.2, repeats=5):
+    """Best seconds per call over several repeats of at least min_time each.
+
+    setup runs untimed before every call. The garbage collector is off
+    while timing, as in timeit.
+    """
+    best = float('inf')
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            calls = 0
+            elapsed = 0.0
+            while elapsed < min_time or calls == 0:
+                if setup is not None:
+                    setup()
+                start = time.perf_counter()
+                fn()
+                elapsed += time.perf_counter() - start
+                calls += 1
+            best = min(best, elapsed / calls)
+            gc.collect()
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def peak_memory(fn, setup=None):
+    """tracemalloc peak in KiB of one call"""
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def clear_structure_memo():
+    structure_result_cache.clear()
+
+
+def with_prints(enabled, fn):
+    """Run fn with the calculator's DEBUG prints sent to a null sink or silenced"""
+    def run():
+        if enabled:
+            stdout = sys.stdout
+            sys.stdout = NullWriter()
+            try:
+                return fn()
+            finally:
+                sys.stdout = stdout
+        calculator_module.print = quiet_print
+        try:
+            return fn()
+        finally:
+            del calculator_module.print
+    return run
+
+
+def case_benchmarks(structures_data):
+    """(name, fn, setup) for every benchmark of one case"""
+    def calculate():
+        return BlockCalculator(structures_data).calculate()
+
+    warmed = []
+
+    def warm_memo():
+        # Fill the memo once; later calls only read it
+        if not warmed:
+            clear_structure_memo()
+            with_prints(False, calculate)()
+            warmed.append(True)
+
+    return [
+        ('calculate', with_prints(True, calculate), clear_structure_memo),
+        ('calculate_quiet', with_prints(False, calculate), clear_structure_memo),
+        ('calculate_warm', with_prints(False, calculate), warm_memo),
+        ('parse', lambda: parse_structures_data(structures_data), None),
+        ('batch', lambda: BatchBlockCalculator([structures_data]).calculate(), None),
+    ]
+
+
+def run_benchmarks(quick=False, name_filter=None):
+    min_time = 0.05 if quick else 0.2
+    repeats = 3 if quick else 5
+    results = {}
+
+    def record(name, fn, setup, structure_count, projects=1):
+        if name_filter and name_filter not in name:
+            return
+        seconds = time_call(fn, setup, min_time=min_time, repeats=repeats)
+        results[name] = {
+            'ops_per_sec': 1 / seconds,
+            'structures_per_sec': structure_count / seconds,
+            'us_per_structure': seconds / max(1, structure_count) * 1e6,
+            'projects': projects,
+            'structures': structure_count,
+            'peak_kib': peak_memory(fn, setup)
+        }
+        print(f"{name:<60} {results[name]['ops_per_sec']:>12.1f} ops/s "
+              f"{results[name]['us_per_structure']:>9.2f} us/structure "
+              f"{results[name]['peak_kib']:>10.1f} KiB", file=sys.stderr)
+
+    for case_name, structures_data in build_cases(quick):
+        structure_count = len(structures_data['structures'])
+        for bench_name, fn, setup in case_benchmarks(structures_data):
+            record(f'{case_name}/{bench_name}', fn, setup, structure_count)
+
+    templates = [{'structures': template['structures'], 'waste_percentage': 10}
+                 for template in HOUSE_TYPE_TEMPLATES.values()]
+    record('templates/batch',
+           lambda: BatchBlockCalculator(templates).calculate(),
+           None,
+           sum(len(data['structures']) for data in templates),
+           projects=len(templates))
+
+    return {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'standards_version': STANDARDS_VERSION,
+            'quick': quick
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print the change per benchmark and return the names that regressed"""
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+
+        speed_ratio = result['ops_per_sec'] / base['ops_per_sec']
+        memory_growth = result['peak_kib'] - base['peak_kib']
+        slower = speed_ratio < 1 - threshold
+        bigger = (memory_growth > MIN_MEMORY_REGRESSION_KIB and
+                  result['peak_kib'] > base['peak_kib'] * (1 + threshold))
+
+        status = 'REGRESSION' if slower or bigger else 'ok'
+        print(f"{name:<60} {speed_ratio:>7.2f}x speed {memory_growth:>+10.1f} KiB  {status}")
+        if slower or bigger:
+            regressions.append(name)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the block calculator')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown / memory growth as a fraction (default 0.2)')
+    parser.add_argument('--quick', action='store_true',
+                        help='shorter timings and no 10,000-structure project')
+    parser.add_argument('--filter', metavar='TEXT', help='only run benchmarks whose name contains TEXT')
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(quick=args.quick, name_filter=args.filter)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print(f"Saved {len(current['results'])} results to {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            return 1
+        print('No regressions')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
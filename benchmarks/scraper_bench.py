@@ -0,0 +1,181 @@
+"""
+Benchmark of the streaming price scraper against BeautifulSoup.
+
+Parses the saved pages in benchmarks/fixtures/ (and copies of them with the
+body repeated 10 and 50 times, standing in for large market pages) with:
+
+    stream          app.utils.price_scraper.iter_records: lxml parser target
+                    fed in 64 KiB chunks, no document tree
+    bs4/html.parser BeautifulSoup tree with the same extraction rule
+    bs4/lxml        the same with BeautifulSoup's lxml tree builder
+
+Before timing, every page is checked to give identical records with all
+three. ops/sec, records/sec and the tracemalloc peak are reported per
+page and parser.
+
+Usage (from the repository root):
+
+    python benchmarks/scraper_bench.py --save benchmarks/scraper_baseline.json
+    python benchmarks/scraper_bench.py --compare benchmarks/scraper_baseline.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bs4
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from app.utils.price_scraper import CELL_TAGS, iter_records, iter_text_chunks
+from calculator_bench import compare, peak_memory, time_call
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Extraction rule of the saved market pages
+MARKET_RULE = {
+    'record': {'tag': 'tr', 'class': 'price-row'},
+    'fields': {'material': '.material', 'region': '@data-city', 'low': '.low', 'high': '.high'}
+}
+
+SCALES = [1, 10, 50]
+
+_SPACES = re.compile(r'\s+')
+
+
+def scaled_page(html, scale):
+    """html with everything inside <body> repeated scale times"""
+    if scale == 1:
+        return html
+    start = html.index('<body>') + len('<body>')
+    end = html.index('</body>')
+    return html[:start] + html[start:end] * scale + html[end:]
+
+
+def stream_records(html, rule):
+    return list(iter_records(iter_text_chunks(html), rule))
+
+
+def bs4_records(html, rule, features):
+    """The records of a rule, extracted from a BeautifulSoup tree"""
+    record = rule['record']
+    soup = BeautifulSoup(html, features)
+    found = soup.find_all(record['tag'], class_=record['class']) if record.get('class') \
+        else soup.find_all(record['tag'])
+
+    records = []
+    for element in found:
+        cells = element.find_all(list(CELL_TAGS), recursive=False)
+        values = {}
+        for field, selector in rule['fields'].items():
+            if isinstance(selector, int):
+                node = cells[selector] if selector < len(cells) else None
+            elif selector.startswith('.'):
+                node = element.find(class_=selector[1:])
+            else:
+                if element.get(selector[1:]) is not None:
+                    values[field] = element[selector[1:]]
+                continue
+            if node is not None:
+                values[field] = _SPACES.sub(' ', node.get_text()).strip()
+        records.append(values)
+    return records
+
+
+def build_cases(quick=False):
+    """(name, html, rule) for every fixture page and scale"""
+    cases = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        name = os.path.splitext(os.path.basename(path))[0]
+        for scale in (SCALES[:-1] if quick else SCALES):
+            cases.append((f'{name}/x{scale}', scaled_page(html, scale), MARKET_RULE))
+    return cases
+
+
+def parsers(html, rule):
+    return [
+        ('stream', lambda: stream_records(html, rule)),
+        ('bs4/html.parser', lambda: bs4_records(html, rule, 'html.parser')),
+        ('bs4/lxml', lambda: bs4_records(html, rule, 'lxml')),
+    ]
+
+
+def run_benchmarks(quick=False, name_filter=None):
+    min_time = 0.05 if quick else 0.2
+    repeats = 3 if quick else 5
+    results = {}
+
+    for case_name, html, rule in build_cases(quick):
+        expected = stream_records(html, rule)
+        for parser_name, fn in parsers(html, rule):
+            if fn() != expected:
+                raise AssertionError(f'{parser_name} extracts different records from {case_name}')
+
+        for parser_name, fn in parsers(html, rule):
+            name = f'{case_name}/{parser_name}'
+            if name_filter and name_filter not in name:
+                continue
+            seconds = time_call(fn, min_time=min_time, repeats=repeats)
+            results[name] = {
+                'ops_per_sec': 1 / seconds,
+                'records_per_sec': len(expected) / seconds,
+                'records': len(expected),
+                'page_kib': len(html.encode('utf-8')) / 1024,
+                'peak_kib': peak_memory(fn)
+            }
+            print(f"{name:<45} {results[name]['ops_per_sec']:>10.1f} ops/s "
+                  f"{results[name]['records_per_sec']:>12.0f} records/s "
+                  f"{results[name]['peak_kib']:>10.1f} KiB", file=sys.stderr)
+
+    return {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'lxml': '.'.join(str(part) for part in etree.LXML_VERSION),
+            'beautifulsoup4': bs4.__version__,
+            'machine': platform.machine(),
+            'quick': quick
+        },
+        'results': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the price page scraper against BeautifulSoup')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown / memory growth as a fraction (default 0.2)')
+    parser.add_argument('--quick', action='store_true', help='shorter timings and no x50 pages')
+    parser.add_argument('--filter', metavar='TEXT', help='only run benchmarks whose name contains TEXT')
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(quick=args.quick, name_filter=args.filter)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print(f"Saved {len(current['results'])} results to {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            return 1
+        print('No regressions')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,5 +8,49 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'static', 'profile_pics')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
+    # Calculation result cache limits (per worker process)
+    CALCULATION_CACHE_MAX_ENTRIES = int(os.environ.get('CALCULATION_CACHE_MAX_ENTRIES', 2000))
+    CALCULATION_CACHE_MAX_BYTES = int(os.environ.get('CALCULATION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # Per-structure results reused when a project is re-saved (per worker process)
+    STRUCTURE_CACHE_MAX_ENTRIES = int(os.environ.get('STRUCTURE_CACHE_MAX_ENTRIES', 50000))
+    STRUCTURE_CACHE_MAX_BYTES = int(os.environ.get('STRUCTURE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    
+    # @cached result cache: 'memory' (per worker process) or 'sqlite' (shared by all workers)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'instance', 'cache.sqlite')
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1000))
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    CACHE_SWEEP_INTERVAL = int(os.environ.get('CACHE_SWEEP_INTERVAL', 60))  # seconds between expiry sweeps
+    
+    # Calculate the built-in house type templates once at startup
+    PRECOMPUTE_TEMPLATE_RESULTS = os.environ.get('PRECOMPUTE_TEMPLATE_RESULTS', 'true').lower() == 'true'
+    
+    # Price sources are fetched concurrently; each gets PRICE_SOURCE_TIMEOUT
+    # seconds and a refresh never waits longer than PRICE_FETCH_DEADLINE
+    PRICE_SOURCE_TIMEOUT = float(os.environ.get('PRICE_SOURCE_TIMEOUT', 5))
+    PRICE_FETCH_DEADLINE = float(os.environ.get('PRICE_FETCH_DEADLINE', 8))
+    
+    # Query the price sources over HTTP (otherwise their data is simulated).
+    # PRICE_SOURCE_BASE_URL sends every source request to one host instead,
+    # e.g. a local stub server in tests
+    PRICE_SOURCES_LIVE = os.environ.get('PRICE_SOURCES_LIVE', 'false').lower() == 'true'
+    PRICE_SOURCE_BASE_URL = os.environ.get('PRICE_SOURCE_BASE_URL', '')
+    PRICE_HTTP_POOL_SIZE = int(os.environ.get('PRICE_HTTP_POOL_SIZE', 10))
+    PRICE_HTTP_RETRIES = int(os.environ.get('PRICE_HTTP_RETRIES', 2))
+    PRICE_HTTP_BACKOFF = float(os.environ.get('PRICE_HTTP_BACKOFF', 0.5))  # seconds, doubled per retry
+    
+    # Background price refresher: renews prices before the 4-hour price cache
+    # expires and retries failed refreshes after PRICE_REFRESH_RETRY seconds
+    PRICE_REFRESHER_ENABLED = os.environ.get('PRICE_REFRESHER_ENABLED', 'true').lower() == 'true'
+    PRICE_REFRESH_INTERVAL = int(os.environ.get('PRICE_REFRESH_INTERVAL', 3 * 3600))
+    PRICE_REFRESH_RETRY = int(os.environ.get('PRICE_REFRESH_RETRY', 300))
+    
+    # Bulk recalculation jobs (admin)
+    RECALCULATION_WORKERS = int(os.environ.get('RECALCULATION_WORKERS', os.cpu_count() or 2))
+    RECALCULATION_CHUNK_SIZE = int(os.environ.get('RECALCULATION_CHUNK_SIZE', 200))
+    RECALCULATION_STALE_AFTER = timedelta(minutes=5)  # no heartbeat -> job is resumable
+    
     # Session settings
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
\ No newline at end of file